@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import json
+import os
+
+from completion_cache import CompletionCache, MemoryBackend, SqliteBackend
+from quickstats_cache import cache_dir
+
+
+
+#______________________Configuration items___________________________________#
+#Analyses kept in memory per process, and on disk for every process on the machine
+analysis_entries = 256
+analyses_path = os.path.join(cache_dir, "analyses.sqlite")
+
+#How long (seconds) the artifacts of an analysis are kept
+analysis_ttl = 7 * 24 * 60 * 60
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def analysis_key(fingerprint, code):
+    '''
+    Key for running code on a dataset: the dataset fingerprint and the code with blank
+    lines and trailing whitespace dropped
+    '''
+    lines = [line.rstrip() for line in code.strip().splitlines() if line.strip()]
+    payload = "\n".join([fingerprint] + lines)
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def dump_artifacts(artifacts):
+    '''
+    Artifacts as JSON, bytes in base64. Not pickle: the cache lives in a shared directory
+    and loading it must not be able to run code
+    '''
+    return json.dumps([[{"bytes": base64.b64encode(part).decode("ascii")} if isinstance(part, bytes) else part
+                        for part in artifact] for artifact in artifacts])
+
+
+def load_artifacts(stored):
+    return [tuple(base64.b64decode(part["bytes"]) if isinstance(part, dict) else part for part in artifact)
+            for artifact in json.loads(stored)]
+
+
+class AnalysisCache:
+    '''
+    What a piece of EDA code displayed (see EdaSandbox.run) for each dataset it ran on.
+    Lets a rerun redraw earlier analyses and a repeated analysis skip the sandbox
+    '''
+
+    def __init__(self, backends=None):
+        self._cache = CompletionCache(backends if backends is not None
+                                      else [MemoryBackend(analysis_entries, analysis_ttl), SqliteBackend(analyses_path, analysis_ttl)])
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def get(self, key, count=True):
+        '''
+        The artifacts for key, or None. Redrawing the chat history passes count=False so
+        only real lookups show in hits and misses
+        '''
+        artifacts = self._cache.get(key, count)
+
+        try:
+            return load_artifacts(artifacts) if artifacts is not None else None
+        except (ValueError, TypeError, KeyError):
+            #Written in another format by an older version
+            return None
+
+    def put(self, key, artifacts):
+        self._cache.put(key, dump_artifacts(artifacts))
@@ -0,0 +1,185 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import time
+
+from pipeline import Pipeline, Session, models, is_api_trigger
+from telemetry import JsonlSink
+
+
+
+#______________________Configuration items___________________________________#
+#Questions worked on at once. LLM calls are the slow part and OpenAI is happy to take
+#many in parallel, Quickstats requests are still capped by http_concurrency
+batch_concurrency = 8
+http_concurrency = 4
+
+#Which of the EDA bot's ideas to run for every question
+default_analysis = "1"
+
+#Model used when none is given, one of the names in pipeline.models
+default_model = "GPT-4o"
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def read_questions(path):
+    '''
+    One question per line. Blank lines and lines starting with # are skipped
+    '''
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def question_dir(out_dir, index, question):
+    slug = re.sub(r"[^a-z0-9]+", "-", question.lower()).strip("-")[:40]
+
+    return os.path.join(out_dir, f"{index:04d}-{slug}")
+
+
+def write_artifacts(artifacts, directory):
+    '''
+    Saves what the analysis displayed: figures as PNG, tables and chart data as Arrow IPC
+    (read them back with eda_sandbox.read_table) and text in analysis.md
+    '''
+    text = []
+
+    for index, artifact in enumerate(artifacts, 1):
+        if artifact[0] == "image":
+            with open(os.path.join(directory, f"figure-{index}.png"), "wb") as f:
+                f.write(artifact[1])
+
+        elif artifact[0] == "table":
+            with open(os.path.join(directory, f"table-{index}.arrow"), "wb") as f:
+                f.write(artifact[1])
+
+        elif artifact[0] == "chart":
+            with open(os.path.join(directory, f"{artifact[1]}-{index}.arrow"), "wb") as f:
+                f.write(artifact[2])
+
+        else:
+            text.append(artifact[1])
+
+    if text:
+        with open(os.path.join(directory, "analysis.md"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(text))
+
+
+def answer(pipeline, question, directory, model, analysis=default_analysis, sinks=()):
+    '''
+    Runs one question through the same messenger -> API -> EDA steps as the chat, with
+    nobody to ask follow up questions. Writes what it got to directory and returns a summary
+    '''
+    os.makedirs(directory, exist_ok=True)
+    session = Session(sinks)
+    result = {"question": question, "directory": directory, "links": [], "messages": []}
+    start = time.perf_counter()
+
+    try:
+        response = pipeline.predict(session, session.messenger_chat, f"Don't forget initial instructions, now answer the following question: {question}",
+                                    model, stage = "messenger")
+
+        if not is_api_trigger(response):
+            #The messenger bot wanted more detail than the question had
+            result["status"] = "needs_detail"
+            result["messages"].append(response)
+
+        else:
+            api_data = pipeline.fetch_data(session, response, model, on_link = result["links"].append,
+                                           on_message = result["messages"].append)
+
+            if api_data is None:
+                result["status"] = "no_data"
+
+            else:
+                with open(os.path.join(directory, "data.csv"), "wb") as f:
+                    f.write(session.dataset.csv_bytes())
+                result["rows"] = len(api_data)
+
+                ideas = pipeline.eda_ideas(session, response, model)
+                with open(os.path.join(directory, "ideas.md"), "w", encoding="utf-8") as f:
+                    f.write(ideas)
+
+                _, artifacts = pipeline.analyze(session, analysis, model)
+                if artifacts is None:
+                    result["status"] = "analysis_failed"
+                else:
+                    write_artifacts(artifacts, directory)
+                    result["status"] = "ok"
+                    result["artifacts"] = len(artifacts)
+
+    except Exception as e:
+        #One bad question shouldn't end the night's run
+        result["status"] = "error"
+        result["messages"].append(f"{type(e).__name__}: {e}")
+
+    result["seconds"] = time.perf_counter() - start
+    result["cost"] = session.total_cost
+    result["stages"] = session.trace.summary()
+
+    with open(os.path.join(directory, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1)
+
+    return result
+
+
+def run_batch(questions, out_dir, model=models[default_model], concurrency=batch_concurrency, analysis=default_analysis,
+              openai_key=None, nass_key=None, pipeline=None):
+    '''
+    Answers every question, up to concurrency at a time, and returns their summaries in
+    question order. Identical Quickstats queries from different questions are pulled once.
+    Keys default to the OPENAI_API_KEY and NASS_API_KEY environment variables
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = Pipeline(openai_key or os.environ.get("OPENAI_API_KEY"), nass_key or os.environ["NASS_API_KEY"],
+                            http_concurrency=http_concurrency, eda_workers=min(concurrency, os.cpu_count() or 1))
+
+    sinks = [JsonlSink(os.path.join(out_dir, "metrics.jsonl"))]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(lambda numbered: answer(pipeline, numbered[1], question_dir(out_dir, *numbered),
+                                                            model, analysis, sinks),
+                                    enumerate(questions, 1)))
+
+    finally:
+        if own_pipeline:
+            pipeline.close()
+
+    with open(os.path.join(out_dir, "results.jsonl"), "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the AgStats pipeline, no UI")
+    parser.add_argument("questions", help="text file with one question per line")
+    parser.add_argument("--out", default="agstats_batch", help="directory for the datasets, analyses and results.jsonl")
+    parser.add_argument("--model", default=default_model, choices=list(models))
+    parser.add_argument("--concurrency", type=int, default=batch_concurrency, help="questions worked on at once")
+    parser.add_argument("--analysis", default=default_analysis, help="which of the EDA ideas to run, or your own")
+    args = parser.parse_args()
+
+    if "NASS_API_KEY" not in os.environ:
+        parser.error("set NASS_API_KEY (and OPENAI_API_KEY)")
+
+    questions = read_questions(args.questions)
+    start = time.perf_counter()
+    results = run_batch(questions, args.out, models[args.model], args.concurrency, args.analysis)
+
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+
+    print(f"{len(results)} questions in {time.perf_counter() - start:.1f}s, {statuses}, "
+          f"${sum(result['cost'] for result in results):.4f}. Results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+'''
+Headless benchmark and load test for the chat -> API -> EDA pipeline.
+
+Drives streamlit_agcensus_GPT.py through Streamlit's AppTest runner with OpenAI and
+Quickstats replaced by local stand-ins replaying the recordings in benchmarks/fixtures,
+each with a configurable latency. Reports per-stage latency percentiles, memory high
+water marks, retry counts and throughput for N concurrent sessions, and writes it all
+as JSON so runs on different commits can be compared.
+
+AppTest is not safe to drive from several threads at once, so every simulated session
+runs in its own process. They share the one Quickstats stand-in and the on-disk caches.
+
+    python benchmarks/bench_pipeline.py --sessions 8 --llm-latency 0.8 --http-latency 0.3 --rows 20000
+    python benchmarks/bench_pipeline.py --out new.json --compare old.json
+'''
+import argparse
+import concurrent.futures
+import contextlib
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+#______________________Configuration items___________________________________#
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+script_path = os.path.join(repo_dir, "streamlit_agcensus_GPT.py")
+
+#Ground truth for what the fake messenger bot recognises in a question
+commodity_words = {"corn": "CORN", "soybean": "SOYBEANS", "cattle": "CATTLE", "wheat": "WHEAT"}
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class Recorder:
+    '''
+    Thread safe store of stage timings and counters
+    '''
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.timings.setdefault(stage, []).append(seconds)
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            with self.time(stage):
+                return function(*args, **kwargs)
+
+        return timed
+
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def pick(share):
+        return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "mean": statistics.fmean(ordered), "p50": pick(.5), "p90": pick(.9),
+            "p99": pick(.99), "max": ordered[-1]}
+
+
+def start_quickstats_stub(rows, latency, error_rate, recorder):
+    '''
+    Local HTTP server that answers like Quickstats from the recorded sample rows.
+    Returns the base URL to point the app's client at
+    '''
+    with open(os.path.join(fixtures_dir, "quickstats_sample.csv"), encoding="utf-8") as f:
+        header, *sample_rows = f.read().splitlines()
+
+    with open(os.path.join(fixtures_dir, "quickstats_vocabulary.json")) as f:
+        vocabulary = json.load(f)
+
+    #Repeat the recorded rows up to the requested size, cycling the state so groupbys have work to do
+    states = vocabulary["state_alpha"]
+    body_rows = [sample_rows[index % len(sample_rows)].replace(",IA,", f",{states[index % len(states)]},")
+                 for index in range(rows)]
+    csv_body = ("\n".join([header] + body_rows) + "\n").encode("utf-8")
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            recorder.count("http_requests")
+            time.sleep(latency)
+
+            if random.random() < error_rate:
+                recorder.count("http_5xx_served")
+                return self._send(503, b"{}", "application/json")
+
+            if url.path.endswith("get_param_values/"):
+                param = query["param"][0]
+                return self._send(200, json.dumps({param: vocabulary.get(param, [])}).encode(), "application/json")
+
+            if url.path.endswith("get_counts/"):
+                return self._send(200, json.dumps({"count": rows}).encode(), "application/json")
+
+            recorder.count("http_bytes", len(csv_body))
+            return self._send(200, csv_body, "text/csv")
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}/api/"
+
+
+def install_openai_stub(latency, tokens_per_second, api_failure_rate, eda_failure_rate, recorder):
+    '''
+    Replaces chat completions on every OpenAI client with a replay of the recorded replies.
+    latency is the time to first token, streaming then runs at tokens_per_second
+    '''
+    import openai
+
+    with open(os.path.join(fixtures_dir, "openai_replies.json")) as f:
+        replies = json.load(f)
+
+    def reply_for(messages):
+        instructions = messages[0]["content"]
+        last = messages[-1]["content"]
+
+        if "trigger another bot" in instructions:
+            question = last.split("answer the following question:", 1)[-1].strip()
+            if re.search(r"\b(19|20)\d{2}\b", question):
+                return "messenger", replies["messenger_api"].format(idea=question)
+            return "messenger", replies["messenger_chat"]
+
+        if "NASS Quickstats API links" in instructions:
+            if last.startswith("Please try again"):
+                recorder.count("api_bot_retries")
+            if random.random() < api_failure_rate:
+                return "api_bot", replies["api_bot_broken"]
+
+            idea = last.lower()
+            commodity = next((value for word, value in commodity_words.items() if word in idea), "CORN")
+            year = (re.findall(r"\b(?:19|20)\d{2}\b", idea) or ["2022"])[0]
+            return "api_bot", replies["api_bot"].format(commodity=commodity, year=year)
+
+        if "first 5 rows of data" in instructions:
+            if last.startswith("Please try again"):
+                recorder.count("eda_retries")
+                return "eda_code", replies["eda_code"]
+            if "what kind of analysis" in last:
+                return "eda_ideas", replies["eda_ideas"]
+            if random.random() < eda_failure_rate:
+                return "eda_code", replies["eda_code_broken"]
+            return "eda_code", replies["eda_code"]
+
+        return "summary", replies["summary"]
+
+    def create(model, messages, temperature=None, stream=False, stream_options=None, **kwargs):
+        stage, text = reply_for(messages)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(text) // 4
+        usage = types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                      total_tokens=prompt_tokens + completion_tokens)
+        recorder.count("llm_calls")
+        recorder.count("llm_prompt_tokens", prompt_tokens)
+        start = time.perf_counter()
+        time.sleep(latency)
+
+        if not stream:
+            time.sleep(completion_tokens / tokens_per_second)
+            recorder.record(f"llm_{stage}", time.perf_counter() - start)
+            message = types.SimpleNamespace(content=text)
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+        def chunks():
+            try:
+                for index in range(0, len(text), 4):
+                    time.sleep(1 / tokens_per_second)
+                    delta = types.SimpleNamespace(content=text[index:index + 4])
+                    yield types.SimpleNamespace(usage=None, choices=[types.SimpleNamespace(delta=delta)])
+                yield types.SimpleNamespace(usage=usage, choices=[])
+            finally:
+                recorder.record(f"llm_{stage}", time.perf_counter() - start)
+
+        return chunks()
+
+    openai.resources.chat.completions.Completions.create = lambda self, *args, **kwargs: create(*args, **kwargs)
+
+
+def instrument(recorder):
+    '''
+    Times the pipeline stages that live in importable modules. pipeline.py imports these
+    names when AppTest first runs the script, which is after this patches them
+    '''
+    import eda_sandbox
+    import quickstats_cache
+    import quickstats_fetch
+    import quickstats_ingest
+
+    quickstats_cache.QuickstatsCache.get = recorder.wrap("cache_lookup", quickstats_cache.QuickstatsCache.get)
+    quickstats_fetch.get_count = recorder.wrap("http_get_counts", quickstats_fetch.get_count)
+    quickstats_fetch.fetch_frame = recorder.wrap("http_fetch_and_parse", quickstats_fetch.fetch_frame)
+    quickstats_fetch.read_quickstats_csv = recorder.wrap("parse", quickstats_fetch.read_quickstats_csv)
+    quickstats_ingest.clean_values = recorder.wrap("clean_values", quickstats_ingest.clean_values)
+    eda_sandbox.EdaSandbox.run = recorder.wrap("eda_exec", eda_sandbox.EdaSandbox.run)
+
+
+def run_session(index, conversation, args, recorder, failures):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(script_path, default_timeout=args.timeout)
+    app.secrets["openai_key"] = "benchmark"
+    app.secrets["nass_key"] = "benchmark"
+
+    with recorder.time("first_render"):
+        app.run()
+
+    #Every session asks about a different year so the caches don't answer everything
+    year = 2017 + index % 6
+
+    for prompt in conversation:
+        start = time.perf_counter()
+        app.chat_input[0].set_value(prompt.format(year=year)).run()
+        recorder.record("turn", time.perf_counter() - start)
+        recorder.count("turns")
+
+        if app.exception:
+            failures.append({"session": index, "prompt": prompt, "error": [error.value for error in app.exception]})
+
+
+def session_process(index, conversations, args):
+    '''
+    One simulated user in a process of its own. Returns its timings, counters, failures
+    and memory high water marks for the parent to merge
+    '''
+    random.seed(args.seed + index)
+    recorder = Recorder()
+    failures = []
+    sys.path.insert(0, repo_dir)
+
+    install_openai_stub(args.llm_latency, args.llm_tokens_per_second, args.api_failure_rate, args.eda_failure_rate, recorder)
+    instrument(recorder)
+
+    tracemalloc.start()
+    for repeat in range(args.repeat):
+        run_session(index + repeat * args.sessions, conversations[index % len(conversations)], args, recorder, failures)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    memory = {"python_heap_peak_mb": traced_peak / 1024 ** 2}
+    if resource is not None:
+        #ru_maxrss is KiB on Linux
+        memory["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return recorder.timings, recorder.counters, failures, memory
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    '''
+    Prints each stage's p50 and p90 next to a previous run's
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\n{'stage':<24}{'p50 before':>12}{'p50 now':>12}{'p90 before':>12}{'p90 now':>12}")
+    for stage, now in sorted(results["stages"].items()):
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        print(f"{stage:<24}{before['p50']:>12.4f}{now['p50']:>12.4f}{before['p90']:>12.4f}{now['p90']:>12.4f}")
+
+    print(f"\nthroughput: {baseline['throughput']['turns_per_second']:.3f} -> {results['throughput']['turns_per_second']:.3f} turns/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated sessions")
+    parser.add_argument("--repeat", type=int, default=1, help="conversations per session")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--http-latency", type=float, default=0.3, help="seconds per Quickstats request")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--api-failure-rate", type=float, default=0.0, help="share of API bot replies with no link")
+    parser.add_argument("--eda-failure-rate", type=float, default=0.0, help="share of EDA code that raises")
+    parser.add_argument("--rows", type=int, default=5000, help="rows in every Quickstats pull")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a turn counts as hung")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    recorder = Recorder()
+
+    #Fresh caches so the first pull of every query really goes over HTTP. The session
+    #processes inherit these, they have to be set before any of the app's modules are imported
+    os.environ["AGSTATS_CACHE_DIR"] = tempfile.mkdtemp(prefix="agstats_bench_")
+    os.environ["AGSTATS_QUICKSTATS_URL"] = start_quickstats_stub(args.rows, args.http_latency, args.http_error_rate, recorder)
+    os.environ.pop("AGSTATS_MIRROR_DIR", None)
+    #AppTest runs the script without a server, which Streamlit warns about on every cached call
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+    with open(os.path.join(fixtures_dir, "conversations.json")) as f:
+        conversations = json.load(f)
+
+    failures = []
+    memory = {"python_heap_peak_mb": 0.0}
+    start = time.perf_counter()
+
+    #spawn, not fork: the parent is running the stub server's threads
+    with concurrent.futures.ProcessPoolExecutor(args.sessions, mp_context=multiprocessing.get_context("spawn")) as pool:
+        sessions = [pool.submit(session_process, index, conversations, args) for index in range(args.sessions)]
+
+        for session in concurrent.futures.as_completed(sessions):
+            timings, counters, session_failures, session_memory = session.result()
+            for stage, values in timings.items():
+                for seconds in values:
+                    recorder.record(stage, seconds)
+            for counter, amount in counters.items():
+                recorder.count(counter, amount)
+            failures.extend(session_failures)
+            #High water marks are per session, the busiest one is what a server has to fit
+            for name, value in session_memory.items():
+                memory[name] = max(memory.get(name, 0.0), value)
+
+    wall_seconds = time.perf_counter() - start
+
+    turns = recorder.counters.get("turns", 0)
+    results = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": vars(args),
+        "stages": {stage: percentiles(values) for stage, values in sorted(recorder.timings.items())},
+        "retries": {"api_bot": recorder.counters.get("api_bot_retries", 0),
+                    "eda": recorder.counters.get("eda_retries", 0),
+                    "http_5xx": recorder.counters.get("http_5xx_served", 0)},
+        "counters": recorder.counters,
+        "memory": memory,
+        "throughput": {"sessions": args.sessions, "turns": turns, "wall_seconds": wall_seconds,
+                       "turns_per_second": turns / wall_seconds if wall_seconds else 0.0},
+        "failures": failures,
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+
+    print(f"{'stage':<24}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<24}{stats['count']:>6}{stats['p50']:>10.4f}{stats['p90']:>10.4f}{stats['p99']:>10.4f}")
+    print(f"\n{turns} turns in {wall_seconds:.1f}s ({results['throughput']['turns_per_second']:.3f} turns/s), "
+          f"retries {results['retries']}, memory {memory}, {len(failures)} failed turns. Saved to {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import copy
+
+
+
+#______________________Configuration items___________________________________#
+#Rough budget (in tokens) for the recent turns we resend on every call, on top of the
+#bot's instructions and the running summary
+history_max_tokens = 3000
+
+#Always resend at least this many of the latest messages, however long they are
+min_recent_messages = 2
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def approx_tokens(text):
+    '''
+    Cheap token estimate, about four characters per token for English plus message overhead
+    '''
+    return len(text) // 4 + 4
+
+
+class ChatHistory:
+    '''
+    One bot's side of the conversation for one session: the instructions (the opening
+    user/assistant pair), any pinned turns, a running summary of older turns and a window
+    of recent turns kept under a token budget
+    '''
+
+    def __init__(self, prompt, max_tokens=history_max_tokens):
+        #Our own copy so appending never touches the module level prompt lists
+        self.prompt = copy.deepcopy(prompt)
+        self.max_tokens = max_tokens
+        self.pinned = []
+        self.summary = None
+        self.turns = []
+
+    def append(self, role, content):
+        self.turns.append({"role": role, "content": f"{content}"})
+
+    def messages(self):
+        '''
+        What actually gets sent to OpenAI
+        '''
+        messages = list(self.prompt) + self.pinned
+
+        if self.summary:
+            messages.append({"role": "user", "content": f"Summary of our conversation so far: {self.summary}"})
+            messages.append({"role": "assistant", "content": "OK"})
+
+        return messages + self.turns
+
+    def pin(self):
+        '''
+        Moves the current turns next to the instructions, where they are resent on every
+        call and never trimmed. They take over from whatever was pinned and summarized before
+        '''
+        self.pinned = self.turns
+        self.summary = None
+        self.turns = []
+
+    def tokens(self):
+        return sum(approx_tokens(turn["content"]) for turn in self.turns)
+
+    def trim(self, summarize=None):
+        '''
+        Moves the oldest turns out of the window until it fits the budget. If summarize is
+        given it is called with (old summary, evicted turns) and returns the new summary,
+        otherwise evicted turns are just dropped
+        '''
+        evicted = []
+
+        while self.tokens() > self.max_tokens and len(self.turns) > min_recent_messages:
+            evicted.append(self.turns.pop(0))
+
+        if evicted and summarize is not None:
+            self.summary = summarize(self.summary, evicted)
+
+        return evicted
+
+    def copy(self):
+        return copy.deepcopy(self)
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from quickstats_cache import cache_dir
+
+
+
+#______________________Configuration items___________________________________#
+#Completions kept in memory per process, and on disk for every process on the machine
+memory_entries = 1024
+completions_path = os.path.join(cache_dir, "completions.sqlite")
+
+#How long (seconds) a cached completion is reused
+completion_ttl = 7 * 24 * 60 * 60
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def completion_key(model, messages, temperature):
+    '''
+    Key for a completion: the model, the messages with whitespace normalized, and the temperature
+    '''
+    normalized = [[message["role"], " ".join(str(message["content"]).split())] for message in messages]
+    payload = json.dumps([model, normalized, round(float(temperature), 3)])
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    '''
+    Least recently used completions for this process. Backends hand entries around as
+    (reply, created) so one copied from disk still expires when the disk copy does
+    '''
+
+    def __init__(self, max_entries=memory_entries, ttl=completion_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            if self._entries[key][1] <= time.time() - self.ttl:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, reply, created=None):
+        with self._lock:
+            self._entries[key] = (reply, created if created is not None else time.time())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteBackend:
+    '''
+    Completions on disk, shared by every Streamlit session and worker process
+    '''
+
+    def __init__(self, path=completions_path, ttl=completion_ttl):
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        #WAL lets readers in other processes carry on while one of us writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, reply TEXT, created REAL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT reply, created FROM completions WHERE key = ? AND created > ?",
+                                     (key, time.time() - self.ttl)).fetchone()
+
+        return tuple(row) if row else None
+
+    def put(self, key, reply, created=None):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?)",
+                               (key, reply, created if created is not None else time.time()))
+            self._conn.execute("DELETE FROM completions WHERE created <= ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+
+class CompletionCache:
+    '''
+    Checks each backend in order (fastest first) and fills the faster ones on a hit further down
+    '''
+
+    def __init__(self, backends=None):
+        self.backends = backends if backends is not None else [MemoryBackend(), SqliteBackend()]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, count=True):
+        for index, backend in enumerate(self.backends):
+            entry = backend.get(key)
+
+            if entry is not None:
+                reply, created = entry
+                for faster_backend in self.backends[:index]:
+                    faster_backend.put(key, reply, created)
+
+                if count:
+                    with self._lock:
+                        self.hits += 1
+                return reply
+
+        if count:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def put(self, key, reply):
+        for backend in self.backends:
+            backend.put(key, reply)
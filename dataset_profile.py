@@ -0,0 +1,102 @@
+from chat_history import approx_tokens
+
+
+
+#______________________Configuration items___________________________________#
+#Rough budget (in tokens) for the dataset summary sent to the EDA bot
+profile_max_tokens = 400
+
+#Most distinct values listed for one text column, the most common ones first
+max_listed_values = 8
+
+#Longer values are cut, some Quickstats descriptions run to a hundred characters
+max_value_chars = 40
+
+#Listed before the other columns so they survive when the budget runs out: what was
+#measured, in which unit, and over which years and places
+priority_columns = ("statisticcat_desc", "unit_desc", "short_desc", "year", "Value", "agg_level_desc",
+                    "state_alpha", "county_name", "domaincat_desc", "reference_period_desc")
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def _short(value):
+    text = str(value)
+    return text if len(text) <= max_value_chars else text[:max_value_chars - 3] + "..."
+
+
+def _number(value):
+    return f"{value:,.6g}" if isinstance(value, float) else f"{value:,}"
+
+
+def profile_dataset(df, max_tokens=profile_max_tokens):
+    '''
+    Compact description of a dataset for a prompt: the row count, then one line per column
+    that varies (numeric range, or distinct values with counts), the share of each
+    redaction code, and last the columns that hold one value on every row. Lines are added
+    in priority order until max_tokens is reached
+    '''
+    if df is None or len(df) == 0:
+        return "The dataset is empty."
+
+    #Everything that needs a pass over the rows, computed for all columns at once
+    distinct = df.nunique(dropna=True)
+    missing = df.isna().mean()
+    numeric = df.select_dtypes("number")
+    lows, highs = numeric.min(), numeric.max()
+
+    code_columns = {column for column in df.columns if column.endswith("_code") and column[:-5] in df.columns}
+    columns = [column for column in priority_columns if column in df.columns]
+    columns += [column for column in df.columns if column not in columns and column not in code_columns]
+
+    lines = [f"{len(df):,} rows. Columns that vary:"]
+    constant = []
+    dropped = []
+
+    for column in columns:
+        if distinct[column] <= 1:
+            if distinct[column] == 1:
+                constant.append(f"{column}={_short(df[column].dropna().iloc[0])}" + (" or missing" if missing[column] > 0 else ""))
+            continue
+
+        if column in numeric.columns:
+            line = f"- {column}: numbers from {_number(lows[column])} to {_number(highs[column])}"
+        else:
+            counts = df[column].value_counts(sort=True)
+            #Categoricals also count the categories that never occur
+            counts = counts[counts > 0].head(max_listed_values)
+            listed = ", ".join(f"{_short(value)} ({count:,})" for value, count in counts.items())
+            more = distinct[column] - len(counts)
+            line = f"- {column}: {distinct[column]:,} values, {listed}" + (f" and {more:,} more" if more > 0 else "")
+
+        if missing[column] > 0:
+            line += f"; {missing[column]:.0%} missing"
+
+            if f"{column}_code" in code_columns:
+                #Why numbers are missing: (D) withheld, (NA) not available, ...
+                codes = df[f"{column}_code"].value_counts() / len(df)
+                codes = codes[codes > 0]
+                if len(codes):
+                    line += ": " + ", ".join(f"{code} {share:.0%}" for code, share in codes.items())
+
+        lines.append(line)
+
+    if constant:
+        lines.append("Same on every row: " + ", ".join(constant))
+
+    #Keep what fits, the row count line always does
+    kept = lines[:1]
+    used = approx_tokens(kept[0])
+
+    for line in lines[1:]:
+        if used + approx_tokens(line) > max_tokens:
+            dropped.append(line)
+            continue
+
+        kept.append(line)
+        used += approx_tokens(line)
+
+    if dropped:
+        kept.append(f"({len(dropped)} more lines left out for length)")
+
+    return "\n".join(kept)
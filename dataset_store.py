@@ -0,0 +1,72 @@
+import hashlib
+
+import pandas as pd
+
+from dataset_profile import profile_dataset
+
+
+
+#Copy-on-write makes shallow copies safe to hand out: whoever writes to one gets their
+#own copy of just that column. It is always on from pandas 3, before that we opt in
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class DatasetStore:
+    '''
+    Holds the one canonical DataFrame for a session. Display and EDA get cheap views
+    and the CSV for the download button is only built when someone asks for it
+    '''
+
+    def __init__(self):
+        self._df = None
+        self._csv = None
+        self._fingerprint = None
+        self._profile = None
+
+    def __bool__(self):
+        return self._df is not None
+
+    def set(self, df):
+        self._df = df
+        self._csv = None
+        self._fingerprint = None
+        self._profile = None
+
+    @property
+    def frame(self):
+        '''
+        The canonical frame, for reading only
+        '''
+        return self._df
+
+    def csv_bytes(self):
+        '''
+        The dataset as CSV, built on first request and reused after that
+        '''
+        if self._csv is None and self._df is not None:
+            self._csv = self._df.to_csv(index=False).encode("utf-8")
+
+        return self._csv
+
+    def fingerprint(self):
+        '''
+        Content hash of the dataset (values, column names and dtypes), computed once
+        '''
+        if self._fingerprint is None and self._df is not None:
+            digest = hashlib.sha256(pd.util.hash_pandas_object(self._df, index=False).values.tobytes())
+            digest.update(repr(list(self._df.dtypes.items())).encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+
+        return self._fingerprint
+
+    def profile(self):
+        '''
+        Compact summary of the dataset for the EDA bot's prompts, computed once
+        '''
+        if self._profile is None and self._df is not None:
+            self._profile = profile_dataset(self._df)
+
+        return self._profile
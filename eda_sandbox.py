@@ -0,0 +1,577 @@
+import atexit
+import contextlib
+import glob
+import hashlib
+import io
+import os
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+from multiprocessing.connection import Connection
+
+try:
+    import resource
+except ImportError:
+    #No rlimits on Windows, the timeout still applies
+    resource = None
+
+
+
+#______________________Configuration items___________________________________#
+#Warm worker processes shared by every session in this Streamlit process
+sandbox_workers = 2
+
+#Limits for one piece of generated EDA code
+cpu_seconds = 30
+memory_bytes = 2 * 1024 ** 3
+wall_seconds = 60
+
+#Datasets are handed to workers as Arrow IPC files here, /dev/shm keeps them in memory
+share_dir = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "agstats_sandbox")
+
+#How many published datasets we keep around for workers to map, the least recently used
+#goes first, but never one a run is still waiting to use. Frames the code caches with
+#cached() are kept next to their dataset and go when it does
+max_published = 16
+
+#Values a cached() computation may read besides df and still be recognised next time
+simple_types = (str, int, float, bool, type(None))
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class EdaError(Exception):
+    '''
+    The generated code failed. The message is what gets sent back to the EDA bot
+    '''
+
+
+class EdaTimeout(EdaError):
+    pass
+
+
+def referenced_datasets(code, names):
+    '''
+    Which of the named datasets code reads: the ones it looks up as datasets['...'], or
+    all of them if it uses datasets any other way (a loop, passing it on)
+    '''
+    lookup = r"""datasets\s*(?:\[|\.get\()\s*(['"])(.*?)\1"""
+
+    if not re.search(r"\bdatasets\b", code):
+        return []
+
+    if re.search(r"\bdatasets\b", re.sub(lookup, "", code)):
+        return list(names)
+
+    looked_up = {match[1] for match in re.findall(lookup, code)}
+
+    return [name for name in names if name in looked_up]
+
+
+#______________________Worker side____________________________________________#
+
+class _Recorder(types.ModuleType):
+    '''
+    Stands in for streamlit inside a worker. Whatever the generated code tries to show
+    is recorded as an artifact: figures as PNG bytes, tables as Arrow IPC bytes, the rest as text
+    '''
+
+    text_calls = {"markdown", "text", "header", "subheader", "title", "caption", "code", "latex",
+                  "success", "info", "warning", "error", "json"}
+    chart_calls = {"line_chart", "bar_chart", "area_chart", "scatter_chart"}
+
+    #Layout that only groups output. What is shown inside is recorded in order, ungrouped
+    container_calls = {"container", "expander", "empty", "spinner", "form", "popover", "status", "chat_message"}
+    #Calls that have nothing to show
+    quiet_calls = {"divider", "balloons", "snow", "toast", "set_page_config", "set_option"}
+
+    def __init__(self):
+        super().__init__("streamlit")
+        self.artifacts = []
+
+    #with col1: / with st.expander(...): and st.sidebar.write(...) all write to the recorder
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def sidebar(self):
+        return self
+
+    def columns(self, spec=2, *args, **kwargs):
+        return [self] * (spec if isinstance(spec, int) else len(spec))
+
+    def tabs(self, labels, *args, **kwargs):
+        return [self] * len(labels)
+
+    def metric(self, label, value, delta=None, *args, **kwargs):
+        self.artifacts.append(("text", f"**{label}**: {value}" + (f" ({delta})" if delta is not None else "")))
+
+    #Nobody is there to pick anything, widgets give back their default
+    def selectbox(self, label, options, index=0, *args, **kwargs):
+        options = list(options)
+        return options[index] if index is not None and options else None
+
+    radio = selectbox
+
+    def multiselect(self, label, options, default=None, *args, **kwargs):
+        return list(default or [])
+
+    def slider(self, label, min_value=None, max_value=None, value=None, *args, **kwargs):
+        return value if value is not None else min_value
+
+    number_input = slider
+
+    def text_input(self, label, value="", *args, **kwargs):
+        return value
+
+    text_area = text_input
+
+    def checkbox(self, label, value=False, *args, **kwargs):
+        return value
+
+    toggle = checkbox
+
+    def button(self, *args, **kwargs):
+        return False
+
+    def cache_data(self, func=None, *args, **kwargs):
+        #Both @st.cache_data and @st.cache_data(ttl=...)
+        return func if callable(func) else lambda func: func
+
+    cache_resource = cache_data
+
+    def pyplot(self, fig=None, *args, **kwargs):
+        import matplotlib.pyplot as plt
+
+        fig = fig if fig is not None else plt.gcf()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        self.artifacts.append(("image", buffer.getvalue()))
+
+    def dataframe(self, data=None, *args, **kwargs):
+        self.artifacts.append(("table", _to_arrow(data)))
+
+    table = dataframe
+
+    def write(self, *args, **kwargs):
+        import pandas as pd
+        from matplotlib.figure import Figure
+
+        for arg in args:
+            if isinstance(arg, (pd.DataFrame, pd.Series)):
+                self.dataframe(arg)
+            elif isinstance(arg, Figure):
+                self.pyplot(arg)
+            else:
+                self.artifacts.append(("text", str(arg)))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        if name in self.text_calls:
+            return lambda body="", *args, **kwargs: self.artifacts.append(("text", str(body)))
+
+        if name in self.chart_calls:
+            return lambda data=None, *args, **kwargs: self.artifacts.append(("chart", name, _to_arrow(data)))
+
+        if name in self.container_calls:
+            return lambda *args, **kwargs: self
+
+        if name in self.quiet_calls:
+            return lambda *args, **kwargs: None
+
+        #Anything else (plotly_chart, altair_chart, ...) would otherwise show nothing
+        raise AttributeError(f"st.{name} is not supported here, show results with st.write, st.dataframe, st.pyplot, "
+                             f"st.markdown, st.metric or st.line_chart/bar_chart/area_chart/scatter_chart")
+
+
+def _to_arrow(data):
+    import pandas as pd
+    import pyarrow as pa
+
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    #Arrow wants string column names
+    df = df.rename(columns=str)
+    table = pa.Table.from_pandas(df)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def _code_parts(code):
+    '''
+    What a code object does, without where it was defined (line numbers, file name)
+    '''
+    consts = tuple(_code_parts(const) if isinstance(const, types.CodeType) else repr(const) for const in code.co_consts)
+
+    return (code.co_code, code.co_names, code.co_varnames, consts)
+
+
+def _frame_key(compute, fingerprint):
+    '''
+    Identifies what compute() returns: its bytecode, the dataset, and the values of the
+    simple variables it reads. None when it reads something we can't fingerprint, like
+    another frame the code built
+    '''
+    import pandas as pd
+
+    names = set()
+    pending = [compute.__code__]
+    while pending:
+        code = pending.pop()
+        names.update(code.co_names)
+        pending.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+
+    values = []
+    for name in sorted(names):
+        if name == "df" or name not in compute.__globals__:
+            #df is covered by the fingerprint, the rest are attributes and builtins
+            continue
+
+        value = compute.__globals__[name]
+        if isinstance(value, (types.ModuleType, type)) or value is pd.DataFrame:
+            continue
+        if not isinstance(value, simple_types):
+            return None
+
+        values.append((name, repr(value)))
+
+    for cell in compute.__closure__ or ():
+        if not isinstance(cell.cell_contents, simple_types):
+            return None
+        values.append(repr(cell.cell_contents))
+
+    payload = repr((fingerprint, _code_parts(compute.__code__), values)).encode("utf-8")
+
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+def _frame_state(df):
+    '''
+    The objects a frame holds right now: its column arrays and index, and the column names.
+    With copy-on-write any change to the frame (assigning or editing a column, filtering or
+    sorting in place, renaming) swaps at least one of them
+    '''
+    return list(df._mgr.arrays) + [df.index], tuple(df.columns)
+
+
+def _same_state(state, other):
+    return len(state[0]) == len(other[0]) and all(a is b for a, b in zip(state[0], other[0])) and state[1] == other[1]
+
+
+def _frame_cache(directory, fingerprint, memo, df):
+    '''
+    The cached() helper generated code can wrap derived frames in, e.g.
+        by_year = cached(lambda: df.groupby("year")["Value"].sum())
+    The first run on a dataset computes and saves the result next to the dataset, later
+    runs (other turns, retries, other workers) map it instead. Only computations on df as
+    the run got it are saved, once the code filters or changes df they just run
+    '''
+    import pandas as pd
+    import pyarrow as pa
+
+    state = _frame_state(df)
+
+    def cached(compute):
+        #The fingerprint only says what df held when the run started
+        untouched = compute.__globals__.get("df") is df and _same_state(_frame_state(df), state)
+        key = _frame_key(compute, fingerprint) if untouched else None
+        if key is None:
+            return compute()
+
+        if key not in memo:
+            path = os.path.join(directory, f"{fingerprint}-{key}.arrow")
+
+            if os.path.exists(path):
+                table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+                frame = table.to_pandas()
+                metadata = table.schema.metadata or {}
+                memo[key] = frame.iloc[:, 0].rename(metadata[b"agstats_series"].decode() or None) if b"agstats_series" in metadata else frame
+
+            else:
+                result = compute()
+                if not isinstance(result, (pd.DataFrame, pd.Series)):
+                    return result
+
+                if isinstance(result, pd.Series):
+                    table = pa.Table.from_pandas(result.to_frame(name="series"))
+                    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                                           b"agstats_series": str(result.name or "").encode()})
+                else:
+                    table = pa.Table.from_pandas(result.rename(columns=str))
+
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as file_writer:
+                    file_writer.write_table(table)
+                os.replace(tmp_path, path)
+
+                memo[key] = result
+
+        #Copy-on-write makes this cheap, and the code can't change the cached frame through it
+        return memo[key].copy(deep=False)
+
+    return cached
+
+
+def _worker_main(reader, writer, cpu_seconds, memory_bytes):
+    #Pay for the heavy imports once per worker, not once per analysis
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    #Same as dataset_store: the df each run gets is a shallow copy, so writes must not
+    #reach the loaded frame the next run starts from
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.options.mode.copy_on_write = True
+
+    if resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+    from workspace import align, join
+
+    loaded_path, loaded_df, memo = None, None, None
+    #The session's other datasets by path, only the ones the latest request named stay mapped
+    mapped = {}
+
+    while True:
+        try:
+            code, dataset_path, dataset_paths = reader.recv()
+        except EOFError:
+            return
+
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime) + cpu_seconds, hard))
+
+        try:
+            if dataset_path != loaded_path:
+                #Memory mapped, so the columns are read straight out of the shared file.
+                #The map stays open as long as the frame might point into it
+                source = pa.memory_map(dataset_path)
+                loaded_df = pa.ipc.open_file(source).read_pandas()
+                loaded_path = dataset_path
+                memo = {}
+
+            mapped = {path: loaded_df if path == dataset_path else mapped[path] if path in mapped
+                      else pa.ipc.open_file(pa.memory_map(path)).read_pandas()
+                      for path in dataset_paths.values()}
+            datasets = {name: mapped[path].copy(deep=False) for name, path in dataset_paths.items()}
+
+            recorder = _Recorder()
+            sys.modules["streamlit"] = recorder
+            stdout = io.StringIO()
+
+            df = loaded_df.copy(deep=False)
+            cached = _frame_cache(os.path.dirname(dataset_path), os.path.basename(dataset_path)[:-len(".arrow")], memo, df)
+
+            with contextlib.redirect_stdout(stdout):
+                exec(code, {"df": df, "st": recorder, "pd": pd, "np": np, "plt": plt,
+                            "cached": cached, "datasets": datasets, "align": align, "join": join})
+
+            if stdout.getvalue():
+                recorder.artifacts.append(("text", stdout.getvalue()))
+
+            writer.send(("ok", recorder.artifacts))
+
+        except MemoryError:
+            writer.send(("error", "MemoryError: the analysis used more memory than allowed"))
+
+        except Exception as e:
+            writer.send(("error", f"{type(e).__name__}: {e}"))
+
+        finally:
+            plt.close("all")
+
+
+#______________________Parent side____________________________________________#
+
+class _Worker:
+    '''
+    One worker process. It is started as "python -m eda_sandbox" rather than through
+    multiprocessing so it never re-imports whatever script happens to be __main__
+    '''
+
+    def __init__(self):
+        parent_read, child_write = os.pipe()
+        child_read, parent_write = os.pipe()
+
+        self.process = subprocess.Popen([sys.executable, "-m", "eda_sandbox", str(child_read), str(child_write),
+                                         str(cpu_seconds), str(memory_bytes)],
+                                        pass_fds=(child_read, child_write), cwd=os.path.dirname(os.path.abspath(__file__)))
+        os.close(child_read)
+        os.close(child_write)
+
+        self.reader = Connection(parent_read, writable=False)
+        self.writer = Connection(parent_write, readable=False)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.reader.close()
+        self.writer.close()
+
+
+def _unlink(path):
+    '''
+    Removes a published dataset file and the cached() frames saved next to it
+    '''
+    for stale_path in [path] + glob.glob(f"{path[:-len('.arrow')]}-*.arrow"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(stale_path)
+
+
+class EdaSandbox:
+    '''
+    Pool of warm worker processes that run generated EDA code away from the Streamlit
+    script thread, with CPU, memory and wall clock limits
+    '''
+
+    def __init__(self, workers=sandbox_workers):
+        self._idle = queue.Queue()
+        self._published = []
+        #Published paths runs have been handed but not finished with, by count
+        self._in_use = {}
+        self._lock = threading.Lock()
+        os.makedirs(share_dir, exist_ok=True)
+
+        for _ in range(workers):
+            self._idle.put(_Worker())
+
+        #The Streamlit app never closes its pipeline, so the files would outlive it otherwise
+        atexit.register(self.close)
+
+    def publish(self, df, fingerprint):
+        '''
+        Writes a dataset once as an Arrow IPC file the workers can memory map. The file is
+        kept until release(path) is called as often as publish returned it
+        '''
+        import pyarrow as pa
+
+        path = os.path.join(share_dir, f"{fingerprint}.arrow")
+
+        with self._lock:
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+
+            if path in self._published:
+                self._published.remove(path)
+
+            #Another app process may have closed and removed it since
+            if not os.path.exists(path):
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+                os.replace(tmp_path, path)
+
+            self._published.append(path)
+
+            self._evict()
+
+        return path
+
+    def release(self, path):
+        with self._lock:
+            self._in_use[path] -= 1
+            if not self._in_use[path]:
+                del self._in_use[path]
+
+            self._evict()
+
+    def _evict(self):
+        '''
+        Unlinks the least recently used files nobody is waiting on until max_published are
+        left. Call with the lock held
+        '''
+        idle = [path for path in self._published if path not in self._in_use]
+
+        #Workers that still have an old file mapped keep their copy, unlinking is safe
+        while len(self._published) > max_published and idle:
+            evicted = idle.pop(0)
+            self._published.remove(evicted)
+            _unlink(evicted)
+
+    def run(self, code, df, fingerprint, timeout=wall_seconds, datasets=None):
+        '''
+        Runs code against df in a worker and returns what it displayed as a list of
+        artifacts. Of datasets ({name: (frame, fingerprint)}), the ones the code reads are
+        handed to it as datasets[name]. Raises EdaError with a message for the EDA bot if it fails
+        '''
+        datasets = datasets or {}
+        dataset_paths = {name: self.publish(*datasets[name]) for name in referenced_datasets(code, datasets)}
+        dataset_path = self.publish(df, fingerprint)
+
+        try:
+            return self._run(code, dataset_path, dataset_paths, timeout)
+
+        finally:
+            for path in [dataset_path, *dataset_paths.values()]:
+                self.release(path)
+
+    def _run(self, code, dataset_path, dataset_paths, timeout):
+        worker = self._idle.get()
+
+        try:
+            if not worker.reader.poll(0) and worker.process.poll() is None:
+                worker.writer.send((code, dataset_path, dataset_paths))
+
+            if not worker.reader.poll(timeout):
+                worker.kill()
+                worker = _Worker()
+                raise EdaTimeout(f"TimeoutError: the analysis took longer than {timeout} seconds")
+
+            try:
+                status, result = worker.reader.recv()
+            except (EOFError, OSError):
+                #The CPU limit kills the process outright
+                worker.kill()
+                worker = _Worker()
+                raise EdaError("The analysis was stopped for using too much CPU time or memory")
+
+        finally:
+            self._idle.put(worker)
+
+        if status == "error":
+            raise EdaError(result)
+
+        return result
+
+    def close(self):
+        '''
+        Stops the workers and removes the files this sandbox published, with their cached() frames
+        '''
+        while not self._idle.empty():
+            self._idle.get().kill()
+
+        with self._lock:
+            for path in self._published:
+                _unlink(path)
+            self._published = []
+
+
+def read_table(table_bytes):
+    '''
+    Turns a table artifact back into a DataFrame for display
+    '''
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(table_bytes).read_pandas()
+
+
+if __name__ == "__main__":
+    _worker_main(Connection(int(sys.argv[1]), writable=False), Connection(int(sys.argv[2]), readable=False),
+                 int(sys.argv[3]), int(sys.argv[4]))
@@ -0,0 +1,643 @@
+import asyncio
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+import openai
+import pandas as pd
+
+from analysis_cache import AnalysisCache, analysis_key
+from chat_history import ChatHistory
+from completion_cache import CompletionCache, completion_key
+from eda_sandbox import EdaSandbox, sandbox_workers
+from quickstats_cache import QuickstatsCache, normalize_query
+from quickstats_client import QuickstatsClient, max_concurrency
+from quickstats_fetch import QuickstatsError, get_count, aget_count, split_query, fetch_frame, fetch_chunked, row_limit
+from quickstats_mirror import QuickstatsMirror, mirror_dir
+from quickstats_query import QuickstatsVocabulary, parse_intent, validate_params, link_params, build_url, invalid_params_message
+from telemetry import Trace, span, load_pricing, completion_cost
+from workspace import Workspace
+
+
+
+#______________________Configuration items___________________________________#
+#Maximum number of times GPT will be asked to fix a broken API link or python code
+num_retries = 5
+
+#Sampling temperature for every bot
+model_temperature = .1
+
+#Candidate links the API bot is asked for at once. They are all checked against Quickstats
+#get_counts in parallel and the first that has data is used, so a bad guess costs one
+#round trip instead of one per retry. 1 asks for a single link per attempt
+url_candidates = 3
+
+#Seconds between redraws while a reply streams in
+render_interval = 0.1
+
+#Models offered to the user, mapped to OpenAI model IDs. Each needs a price in pricing.json
+models = {"GPT-3.5": "gpt-3.5-turbo",
+          "GPT-4": "gpt-4",
+          "GPT-4o": "gpt-4o-2024-11-20"}
+
+#Introduction text
+introduction_text = "Hello! I'm AgStats, a large language model trained to query the NASS Quickstats API. I can help you find agricultural data on a variety of subjects. How can I assist you today?"
+
+
+##___________________Bot 1 configuration______________________________##
+messenger_bot_chat = [{"role": "user", "content":
+                    """
+                    You are a bot trained to trigger another bot that makes API URL links. When you feel you have enough information for the next bot to make a URL links, respond with "API-" along
+                    with the natural language idea the user or yourself generated. Before typing 'API - ' you must know the agricultural subject (cow, pig, apples, etc.), time period, and geographic level. Not having these will make you fail.
+                    Do not respond 'API - '  if you still need to inquire more details. Responding with "API-{idea_here}" should only be done once you have understood the ask entirely. IF YOU DO NOT INCLUDE THE DASH YOU WILL FAIL.
+                    DO NOT UNDER ANY CIRCUMSTANCE TELL THE USER YOU WILL QUERY THE API. Once you type 'API- ' you can not enquire the user anymore about geographic level, time period, etc. You must have all the info you need.
+
+                    Please present yourself as AgStats, a large language model trained to query the NASS Quickstats API. Do not introduce yourself more than once. You can help guide the user to finding out what data they are looking for.
+                    Example: if a user asks what data you can access, you could explain you have access to X, Y, and Z.
+                    """},
+                   {"role": "assistant", "content": "OK"}]
+
+
+##___________________Bot 2 configuration______________________________##
+api_bot_chat = [{"role": "user", "content":
+                    """
+                    You are a large language model trained to convert questions about agricultural data into NASS Quickstats API links.
+                    When answering a question only provide the URL link and skip any other ouputs unless it is a task you cannot do. Do not provide any instructions other than an API link.
+                    If you can complete the task, respond with 'SUCCESS' followed immediately by the API link. Include no additional text explaining the API link or saying something like 'here it is'
+                    """},
+                   {"role": "assistant", "content": "OK"}]
+
+
+
+
+##___________________Bot 3 configuration______________________________##
+eda_bot_chat_og = [{"role": "user", "content":
+                    """
+                    You are a large language model trained to take in the first 5 rows of data frome a dataframe along with some context and come up with the best 3
+                    exploratory data analysis ideas. The ideas should be fairly simple and able to be done in a couple lines of python code. examples include making a matplotlib graph, group by statements, etc.
+
+                    The user's next input will be to select one of those ideas, and which idea they choose, output that python code and only that python code, no other text for the second response. When developing python code, refer to column names
+                    do not create lists of data
+
+                    If your python code does not display your results you will fail. You are in a stremlit environment. All final results need to be outputted for streamlit. So if it's a plot, you would need to save a figure and do:
+                        st.pyplot(fig), if it's a dataframe it would be st.dataframe(df)
+                    Use matplotlib for plots, st.plotly_chart and st.altair_chart are not available.
+
+
+                    Here is part of an exmaple output:
+
+
+                    '''
+                    Idea 1: print "Hello world"
+
+                    ```python
+                    print("Hello world")
+                    ```
+                    '''
+
+                    Only output 3 and only 3 ideas, and below each idea place the python code for how to do it.
+
+                    """},
+                   {"role": "assistant", "content": "OK"}]
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def is_api_trigger(response):
+    '''
+    True when the messenger bot is handing off to the API bot
+    '''
+    return response.startswith('API') or 'API -' in response or 'API Generate' in response
+
+
+def hide_api_trigger(text):
+    '''
+    Render filter for the messenger bot, its "API- ..." hand offs are not meant for the user
+    '''
+    if is_api_trigger(text) or "API".startswith(text[:3]):
+        return ""
+
+    return text
+
+
+def hide_code(text):
+    '''
+    Render filter for the EDA bot ideas, the python code stays behind the scenes.
+    Also hides a code block that is still streaming in
+    '''
+    return re.sub("\n```python.*?(\n```|$)", '', text, flags=re.DOTALL)
+
+
+def stream_text(stream, on_text):
+    '''
+    Collects a streamed completion. on_text(text so far, done) is called at most every
+    render_interval seconds while it streams and once more at the end.
+    Returns the full text and the token usage from the stream's final chunk
+    '''
+    chunks = []
+    usage = None
+    last_render = 0.0
+
+    for chunk in stream:
+        #The last chunk carries the usage and no choices
+        if chunk.usage is not None:
+            usage = chunk.usage
+
+        if chunk.choices and chunk.choices[0].delta.content:
+            chunks.append(chunk.choices[0].delta.content)
+
+            if time.monotonic() - last_render >= render_interval:
+                on_text("".join(chunks), False)
+                last_render = time.monotonic()
+
+    reply_txt = "".join(chunks)
+    on_text(reply_txt, True)
+
+    return reply_txt, usage
+
+
+def with_profile(text, model_type_chat, dataset):
+    '''
+    Adds the dataset summary to a retry prompt, unless the bot can still see it from the
+    ideas turn (it falls out of the window once the history gets trimmed)
+    '''
+    profile = dataset.profile()
+
+    if any(profile in message["content"] for message in model_type_chat.messages()):
+        return text
+
+    return f"{text}\nAs a reminder, here is a summary of the data: {profile}"
+
+
+class Session:
+    '''
+    Everything one conversation owns: each bot's history, the datasets it pulled, the
+    running cost and the trace of what it spent time on. Nothing in here touches Streamlit
+    '''
+
+    def __init__(self, sinks=()):
+        self.messenger_chat = ChatHistory(messenger_bot_chat)
+        self.api_chat = ChatHistory(api_bot_chat)
+        self.eda_chat = ChatHistory(eda_bot_chat_og)
+        #Snapshot of the EDA conversation right after the ideas, analysis turns build on it
+        self.eda_convo = None
+        #Every pull of the conversation by name, the latest is the active dataset
+        self.workspace = Workspace()
+        self.analysis = False
+
+        self.total_cost = 0.0
+        self.cost = []
+        self.total_tokens = []
+        self.trace = Trace(sinks)
+
+    @property
+    def dataset(self):
+        '''
+        The active dataset's DatasetStore, what the EDA bot calls df
+        '''
+        return self.workspace.active
+
+    def add_usage(self, tokens, cost):
+        self.total_tokens.append(tokens)
+        self.cost.append(cost)
+        self.total_cost += cost
+
+
+class Pipeline:
+    '''
+    The chat -> API -> EDA pipeline. Holds the pieces that are expensive to build and safe
+    to share (HTTP client, caches, vocabulary, sandbox), so make one per process and pass
+    each call the Session it is working for
+    '''
+
+    def __init__(self, openai_key, nass_key, http_concurrency=max_concurrency, eda_workers=sandbox_workers):
+        self.nass_key = nass_key
+        self.openai = openai.OpenAI(api_key=openai_key)
+
+        #One pooled HTTP client with timeouts and retries for every Quickstats request
+        self.quickstats_client = QuickstatsClient(nass_key, max_concurrency=http_concurrency)
+
+        #Parsed Quickstats pulls are kept on disk so repeat questions skip the HTTP round trip
+        self.response_cache = QuickstatsCache()
+
+        #Legal Quickstats parameter values, used to build URLs without the API bot and to catch bad ones before fetching
+        self.vocabulary = QuickstatsVocabulary(self.quickstats_client)
+
+        #In-memory LRU in front of the on-disk SQLite completions
+        self.completion_cache = CompletionCache()
+
+        #What each piece of EDA code displayed per dataset, for reruns and repeated analyses
+        self.analysis_cache = AnalysisCache()
+
+        #What each OpenAI model costs, see pricing.json
+        self.pricing = load_pricing()
+
+        #The local bulk Quickstats mirror if one has been loaded (see quickstats_mirror.py)
+        self.mirror = None
+        if mirror_dir is not None and os.path.exists(os.path.join(mirror_dir, "_manifest.json")):
+            self.mirror = QuickstatsMirror(mirror_dir)
+
+        self.eda_workers = eda_workers
+        self._sandbox = None
+        self._lock = threading.Lock()
+
+        #Quickstats pulls in flight, so identical queries asked at the same time share one
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    @property
+    def sandbox(self):
+        '''
+        The pool of EDA worker processes, started the first time an analysis runs
+        '''
+        with self._lock:
+            if self._sandbox is None:
+                self._sandbox = EdaSandbox(self.eda_workers)
+
+        return self._sandbox
+
+    def close(self):
+        self.quickstats_client.close()
+        if self._sandbox is not None:
+            self._sandbox.close()
+
+    def api_read(self, response, row_count=None):
+        '''
+        Takes the output of API bot and grabs the data. row_count saves asking Quickstats
+        again when the caller already knows how big the pull is
+        '''
+        api_link = response.split()
+        api_link = [link for link in api_link if link.startswith('https')]
+        if not api_link:
+            api_error_message = "No link made"
+            return(api_error_message)
+
+        api_link = api_link[0]
+        api_link = api_link.replace("YOUR_API_KEY", self.nass_key)
+
+        query_params = normalize_query(api_link)
+
+        #Another session or batch question is pulling this exact query right now? Wait for
+        #its result instead of sending the same requests twice
+        key = tuple(query_params)
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            first = pending is None
+            if first:
+                pending = self._pending[key] = concurrent.futures.Future()
+
+        if not first:
+            return pending.result()
+
+        try:
+            result = self._pull(query_params, api_link, row_count)
+            pending.set_result(result)
+
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+
+        return result
+
+    def _pull(self, query_params, api_link, row_count=None):
+        '''
+        DataFrame for one query from the disk cache, the mirror or Quickstats, or the error message
+        '''
+        #Same commodity, year and geography as an earlier pull? Read it off disk instead
+        cached_df = self.response_cache.get(query_params)
+        if cached_df is not None:
+            return(cached_df)
+
+        params = link_params(api_link)
+
+        #Heavy users can load the bulk dumps locally, no HTTP and no row limit
+        if self.mirror is not None:
+            with span("mirror") as record:
+                mirror_df = self.mirror.query(params)
+                record["rows"] = 0 if mirror_df is None else len(mirror_df)
+
+            if mirror_df is not None and not mirror_df.empty:
+                return(mirror_df)
+
+        try:
+            #Ask Quickstats how big the pull is before downloading anything
+            if row_count is None:
+                row_count = get_count(params, self.quickstats_client)
+
+            if row_count == 0:
+                return(pd.DataFrame())
+
+            elif row_count > row_limit:
+                #Too big for one request, so pull it in pieces and stack them
+                chunks = split_query(params, self.quickstats_client, self.vocabulary, count=row_count)
+                df = fetch_chunked(chunks, self.quickstats_client)
+
+            else:
+                df = fetch_frame(params, self.quickstats_client)
+
+        except QuickstatsError as e:
+            return(str(e))
+
+        except:
+            api_error_message = "Broken API url"
+
+            return(api_error_message)
+
+        if not df.empty:
+            self.response_cache.put(query_params, df)
+
+        return(df)
+
+    def predict(self, session, model_type_chat, user_input, model, on_text=None, stage="llm"):
+        '''
+        Takes a user's input and attemtps to generate a response. model_type_chat is one of
+        the session's ChatHistory objects. With on_text the reply is streamed and handed over
+        as it arrives (see stream_text). stage names the call's span
+        '''
+        model_type_chat.append("user", user_input)
+        messages = model_type_chat.messages()
+
+        with session.trace.span(stage, model=model) as record:
+            #Same model, conversation and temperature as an earlier call? Reuse that answer for free
+            cache_key = completion_key(model, messages, model_temperature)
+            reply_txt = self.completion_cache.get(cache_key)
+
+            if reply_txt is not None:
+                usage = None
+                record["cached"] = True
+
+                if on_text is not None:
+                    on_text(reply_txt, True)
+
+                session.add_usage(0, 0.0)
+
+            elif on_text is None:
+                response = self.openai.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature = model_temperature)
+
+                reply_txt = response.choices[0].message.content
+                usage = response.usage
+
+            else:
+                stream = self.openai.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature = model_temperature,
+                    stream=True,
+                    stream_options={"include_usage": True})
+
+                reply_txt, usage = stream_text(stream, on_text)
+
+            record["bytes"] = len(reply_txt.encode("utf-8"))
+            record.update(self.record_usage(session, usage, model))
+
+        if usage is not None:
+            self.completion_cache.put(cache_key, reply_txt)
+
+        model_type_chat.append("assistant", reply_txt)
+
+        #Keep the next call's prompt bounded, older turns get folded into a summary
+        model_type_chat.trim(summarize = lambda summary, turns: self.summarize_turns(session, summary, turns, model))
+
+        return reply_txt
+
+    def summarize_turns(self, session, summary, turns, model):
+        '''
+        Folds turns that fell out of a bot's history window into its running summary
+        '''
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+
+        with session.trace.span("summarize", model=model) as record:
+            response = self.openai.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": f"""Summarize this conversation in a few sentences. Keep every detail about the data asked for
+                           (commodity, years, geography, statistics, API links, column names and which analysis ideas were chosen).
+                           Earlier summary: {summary or 'none'}
+                           Conversation: {transcript}"""}],
+                temperature = model_temperature)
+
+            record.update(self.record_usage(session, response.usage, model))
+
+        return response.choices[0].message.content
+
+    def record_usage(self, session, usage, model):
+        '''
+        Adds a completion's tokens and cost to the session's running totals and returns
+        them as span fields
+        '''
+        #A stream that was cut short never gets its usage chunk
+        if usage is None:
+            return {"tokens": 0, "cost": 0.0}
+
+        cost = completion_cost(self.pricing, model, usage.prompt_tokens, usage.completion_tokens)
+        session.add_usage(usage.total_tokens, cost)
+
+        return {"tokens": usage.total_tokens, "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens, "cost": cost}
+
+    def candidate_links(self, session, response, model, candidates=url_candidates):
+        '''
+        Asks the API bot for several different links in one completion. Returns the chosen
+        link and its row count, or None and a message telling the bot what went wrong with each
+        '''
+        reply = self.predict(session, session.api_chat, f"""{response}
+                             Give {candidates} different API links for this, one per line with the most likely first.
+                             Where you are unsure of a parameter value, use a different guess in each link.""",
+                             model, stage = "api_bot")
+
+        links = list(dict.fromkeys(word for word in reply.split() if word.startswith("https")))[:candidates]
+        if not links:
+            return None, "Please try again to create an API url that will result in a dataframe"
+
+        problems = []
+        checked = []
+
+        #Don't spend an HTTP call on values Quickstats is going to reject anyway
+        for link in links:
+            invalid_params = validate_params(link_params(link), self.vocabulary)
+            if invalid_params:
+                problems.append(f"{link}\n{invalid_params_message(invalid_params)}")
+            else:
+                checked.append(link)
+
+        async def count_all():
+            return await asyncio.gather(*(aget_count(link_params(link), self.quickstats_client) for link in checked),
+                                        return_exceptions=True)
+
+        counts = asyncio.run(count_all()) if checked else []
+        oversized = None
+
+        #The bot's order is its confidence, so the first link with data wins
+        for link, count in zip(checked, counts):
+            if isinstance(count, Exception):
+                problems.append(f"{link}\nGave the error: {count}")
+
+            elif count == 0:
+                problems.append(f"{link}\nReturned no rows")
+
+            elif count > row_limit:
+                problems.append(f"{link}\nHas {count} rows, more than the {row_limit} row limit")
+                oversized = oversized or (link, count)
+
+            else:
+                return (link, count), None
+
+        #Nothing under the limit, but a big pull can still be fetched in pieces
+        if oversized is not None:
+            return oversized, None
+
+        return None, "Please try again, I got an error using each of those links:\n" + "\n".join(problems)
+
+    def fetch_data(self, session, response, model, on_link=None, on_message=None, candidates=url_candidates):
+        '''
+        Turns the messenger bot's "API- ..." hand off into a DataFrame. Our own URL goes
+        first when the idea is clear enough, then the API bot gets num_retries attempts,
+        each with several candidate links (see url_candidates).
+        on_link sees every link tried and on_message anything the user should be told.
+        The data is added to the session's workspace as the active dataset. Returns None
+        when no data came back
+        '''
+        on_link = on_link or (lambda link: None)
+        on_message = on_message or (lambda text: None)
+        session.trace.activate()
+
+        #Build the URL ourselves when the idea is clear enough, the API bot is only the fallback
+        query_params = parse_intent(response, self.vocabulary)
+        direct_link = build_url(query_params) if query_params is not None else None
+
+        api_num_tries = 0
+
+        while (api_num_tries < num_retries):
+            row_count = None
+
+            if direct_link is not None:
+                api_link_ = direct_link
+                direct_link = None
+                used_direct_link = True
+
+            elif candidates > 1:
+                chosen, feedback = self.candidate_links(session, response, model, candidates)
+                used_direct_link = False
+
+                if chosen is None:
+                    api_num_tries += 1
+                    session.api_chat.append("user", feedback)
+                    continue
+
+                api_link_, row_count = chosen
+
+            else:
+                api_link_ = self.predict(session, session.api_chat, response, model, stage = "api_bot")
+                used_direct_link = False
+
+                #Don't spend an HTTP call on values Quickstats is going to reject anyway
+                invalid_params = validate_params(link_params(api_link_), self.vocabulary)
+                if invalid_params:
+                    on_link(api_link_)
+                    api_num_tries += 1
+                    session.api_chat.append("user", invalid_params_message(invalid_params))
+                    continue
+
+            on_link(api_link_)
+            api_data = self.api_read(api_link_, row_count)
+
+            if isinstance(api_data, pd.DataFrame) and api_data.shape[0] > 1:
+                session.workspace.add(api_data, link_params(api_link_))
+                return session.dataset.frame
+
+            api_num_tries += 1
+            too_much_data = isinstance(api_data, str) and api_data == 'Too much data requested'
+
+            if used_direct_link and not too_much_data:
+                #The API bot never saw our link, so let it have a go on the next pass
+                continue
+
+            if isinstance(api_data, pd.DataFrame):
+                session.api_chat.append("user", "Please try again, I got an error using that link")
+
+            elif api_data == 'No link made':
+                session.api_chat.append("user", "Please try again to create an API url that will result in a dataframe")
+
+            elif api_data == 'Broken API url':
+                session.api_chat.append("user", "Please try again, I got an error using that link")
+
+            elif too_much_data:
+                on_message("I'm sorry, your request exceeds the NASS API. Please limit your request and try again.")
+                return None
+
+            else:
+                session.api_chat.append("user", "Please try again, I got some unknown error using that link")
+
+        on_message("I'm sorry, but I'm unable to get that data. Can you try again?")
+        return None
+
+    def eda_ideas(self, session, response, model, on_text=None):
+        '''
+        Asks the EDA bot for analysis ideas on the session's dataset. Returns them with the
+        code hidden and keeps the conversation for the analysis turns that follow
+        '''
+        eda_output = self.predict(session, session.eda_chat, model = model, on_text = on_text, stage = "eda_generation",
+                                  user_input = f"""what kind of analysis could I do on a dataframe from USDA NASS that {response}. Ensure your python code prints the output in a streamlit environment.
+                                  The dataframe is called df. Columns like 'statisticcat_desc' and 'unit_desc' can mix several measurements, so any analysis you do should filter them first.
+                                  Here is a summary of the data: {session.dataset.profile()}
+                                  {session.workspace.describe()}""")
+
+        #The analysis turns refer to these ideas by number, so they must never be summarized away
+        session.eda_chat.pin()
+        session.eda_convo = session.eda_chat.copy()
+
+        return hide_code(eda_output)
+
+    def analyze(self, session, request, model):
+        '''
+        Gets code for the requested analysis from the EDA bot and runs it in the sandbox,
+        sending errors back for a fix up to num_retries times. Returns the analysis key and
+        what the code displayed as a list of artifacts, or (None, None) if no attempt worked.
+        The same code on the same datasets comes out of analysis_cache without running
+        '''
+        session.trace.activate()
+        eda_bot_chat = session.eda_convo.copy()
+
+        eda_output = self.predict(session, eda_bot_chat, f""" REMEMBER YOU ARE IN A STREAMLIT ENVIRONMENT. PLEASE ENSURE YOUR PROPERLY PRINT RESULTS FOR the following and set clear_figure=False: {request}
+                                  Wrap filters and groupbys taken straight from df, before anything reassigns or changes it, as cached(lambda: ...) so later analyses can reuse them.
+                                  {session.workspace.describe()}""",
+                                  model, stage = "eda_generation")
+
+        for _ in range(num_retries):
+            try:
+                code = eda_output.split('```python')[1].split('```')[0]
+                #The code can read every dataset in the workspace, so all of them are in the key
+                key = analysis_key(session.workspace.fingerprint(), code)
+
+                with session.trace.span("exec", rows=len(session.dataset.frame)) as record:
+                    artifacts = self.analysis_cache.get(key)
+                    record["cached"] = artifacts is not None
+
+                    if artifacts is None:
+                        #Runs in a worker process, we only get back what it wanted to show
+                        artifacts = self.sandbox.run(code, session.dataset.frame, session.dataset.fingerprint(),
+                                                     datasets={name: (store.frame, store.fingerprint())
+                                                               for name, store in session.workspace.stores().items()})
+                        self.analysis_cache.put(key, artifacts)
+
+                    record["bytes"] = sum(len(part) for artifact in artifacts for part in artifact[1:])
+
+                session.eda_convo = eda_bot_chat
+
+                return key, artifacts
+
+            except Exception as e:
+                eda_output = self.predict(session, eda_bot_chat, with_profile(f"Please try again, I got the following error with that code: {e}", eda_bot_chat, session.dataset),
+                                          model, stage = "eda_generation")
+
+                session.eda_convo = eda_bot_chat
+
+        return None, None
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+import pandas as pd
+
+
+
+#______________________Configuration items___________________________________#
+#Where cached Quickstats pulls live. Every Streamlit session and worker process on
+#the machine reads and writes the same directory, so point it at shared storage if needed
+cache_dir = os.environ.get("AGSTATS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "agstats_cache"))
+
+#How long (seconds) a cached pull is trusted before we go back to Quickstats
+cache_ttl = 24 * 60 * 60
+
+#Upper bound on the size of the cache directory, least recently used pulls go first
+cache_max_bytes = 512 * 1024 * 1024
+
+#Query parameters that do not change which rows come back
+ignored_params = {"key", "format"}
+
+#Bump whenever the shape of a cached frame changes so old files are simply missed
+cache_version = 2
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def normalize_query(api_link):
+    '''
+    Turns a Quickstats URL into a sorted list of (parameter, value) pairs with the
+    API key and output format stripped out, so the same question always looks the same
+    '''
+    query = urlsplit(api_link.strip()).query
+    params = [(name.strip().lower(), value.strip()) for name, value in parse_qsl(query, keep_blank_values=True)]
+    params = [(name, value) for name, value in params if name not in ignored_params and value != '']
+
+    return sorted(params)
+
+
+def cache_key(params):
+    '''
+    Content address of a normalized query
+    '''
+    return hashlib.sha256(json.dumps([cache_version, params]).encode("utf-8")).hexdigest()
+
+
+class QuickstatsCache:
+    '''
+    On-disk cache of parsed Quickstats pulls stored as Parquet files named after the
+    hash of the query. Writes are atomic renames so several processes can share it.
+    '''
+
+    def __init__(self, directory=cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, params):
+        return os.path.join(self.directory, f"{cache_key(params)}.parquet")
+
+    def get(self, params):
+        '''
+        Returns the cached DataFrame for a normalized query or None on a miss
+        '''
+        path = self._path(params)
+
+        try:
+            stats = os.stat(path)
+
+            if time.time() - stats.st_mtime > self.ttl:
+                os.remove(path)
+                return None
+
+            df = pd.read_parquet(path)
+
+            #Bump the access time by hand, plenty of filesystems are mounted noatime
+            os.utime(path, (time.time(), stats.st_mtime))
+
+            return df
+
+        except FileNotFoundError:
+            return None
+
+        except Exception:
+            #A half written or corrupt file is just a miss
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            return None
+
+    def put(self, params, df):
+        '''
+        Stores a DataFrame for a normalized query and trims the cache back under its limits
+        '''
+        path = self._path(params)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+
+        try:
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+        except Exception:
+            #Caching is best effort, the caller already has its data
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Drops expired entries, then least recently used ones until we fit in max_bytes
+        '''
+        now = time.time()
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".parquet"):
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+                stats = os.stat(path)
+
+                if now - stats.st_mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    entries.append((stats.st_atime, stats.st_size, path))
+
+            except FileNotFoundError:
+                #Another process got to it first
+                continue
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_bytes -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
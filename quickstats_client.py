@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+
+#______________________Configuration items___________________________________#
+#Point this at a local stub server to exercise the app without touching Quickstats
+base_url = os.environ.get("AGSTATS_QUICKSTATS_URL", "https://quickstats.nass.usda.gov/api/")
+
+#Seconds to wait for the connection and then for Quickstats to start answering
+connect_timeout = 5
+read_timeout = 120
+
+#Retries on 429 and 5xx with exponential backoff (0.5s, 1s, 2s, ...)
+max_retries = 4
+backoff_factor = 0.5
+retry_statuses = (429, 500, 502, 503, 504)
+
+#A response that stopped coming is not asked for again, each retry could wait read_timeout
+read_retries = 0
+
+#Most requests we keep in flight against Quickstats from one process
+max_concurrency = 4
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class QuickstatsClient:
+    '''
+    Shared HTTP client for Quickstats: one keep-alive connection pool, timeouts, retries
+    with backoff and a cap on concurrent requests, with async versions for fanning out
+    '''
+
+    def __init__(self, api_key, base_url=base_url, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                 max_retries=max_retries, backoff_factor=backoff_factor, max_concurrency=max_concurrency,
+                 read_retries=read_retries):
+        self.api_key = api_key
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        retry = Retry(total=max_retries, read=read_retries, backoff_factor=backoff_factor, status_forcelist=retry_statuses,
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, endpoint, params):
+        '''
+        GET an endpoint like "api_GET/" with the API key filled in. Waits for a free slot first
+        '''
+        with self._slots:
+            return self.session.get(self.base_url + endpoint, params={"key": self.api_key, **params},
+                                    timeout=self.timeout)
+
+    def get_json(self, endpoint, params):
+        return self.get(endpoint, params).json()
+
+    @contextmanager
+    def stream(self, endpoint, params):
+        '''
+        Like get, but the body is read by the caller as it arrives. The slot is held until
+        the with block ends so a slow download still counts against max_concurrency
+        '''
+        with self._slots:
+            response = self.session.get(self.base_url + endpoint, params={"key": self.api_key, **params},
+                                        timeout=self.timeout, stream=True)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    async def aget_json(self, endpoint, params):
+        '''
+        Async get_json. The request runs on a worker thread so the event loop stays free
+        '''
+        return await asyncio.to_thread(self.get_json, endpoint, params)
+
+    async def agather_json(self, endpoint, params_list):
+        '''
+        Runs several requests at once, still bounded by max_concurrency, results in order
+        '''
+        return await asyncio.gather(*(self.aget_json(endpoint, params) for params in params_list))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,185 @@
+import asyncio
+from contextlib import contextmanager
+
+import requests
+import urllib3
+
+from quickstats_ingest import read_quickstats_csv, concat_frames
+from telemetry import span
+
+
+
+#______________________Configuration items___________________________________#
+#Quickstats refuses anything over this many rows in one request
+row_limit = 50000
+
+#Dimensions we are allowed to split an oversized query on, in order
+split_dims = ("year", "state_alpha")
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class QuickstatsError(Exception):
+    '''
+    Raised with the same messages api_read hands back to the main flow
+    '''
+
+
+def _raise_for_error(data):
+    if "error" not in data:
+        return
+
+    if data['error'] == ['exceeds limit=50000']:
+        raise QuickstatsError("Too much data requested")
+
+    elif data['error'] == ['bad request - invalid query']:
+        raise QuickstatsError("Broken API url")
+
+    else:
+        raise QuickstatsError("Some other error")
+
+
+@contextmanager
+def _translate_errors():
+    try:
+        yield
+
+    #urllib3's own timeout is what a body read as it streams in raises
+    except (requests.exceptions.Timeout, urllib3.exceptions.TimeoutError):
+        raise QuickstatsError("Quickstats timed out")
+
+    except requests.exceptions.ConnectionError as e:
+        #Once the retries run out, a read timeout comes wrapped in a ConnectionError
+        if isinstance(getattr(e.args[0] if e.args else None, "reason", None), urllib3.exceptions.TimeoutError):
+            raise QuickstatsError("Quickstats timed out")
+
+        raise QuickstatsError("Some other error")
+
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError):
+        raise QuickstatsError("Some other error")
+
+    except ValueError:
+        raise QuickstatsError("Broken API url")
+
+
+def _count(data):
+    _raise_for_error(data)
+
+    #What is left after the retries gave up on a 5xx
+    if "count" not in data:
+        raise QuickstatsError("Some other error")
+
+    return int(data["count"])
+
+
+def get_count(params, client):
+    '''
+    Number of rows a query would return, without downloading them
+    '''
+    with span("http_count"), _translate_errors():
+        return _count(client.get_json("get_counts/", params))
+
+
+async def aget_count(params, client):
+    with span("http_count"), _translate_errors():
+        return _count(await client.aget_json("get_counts/", params))
+
+
+def fetch_frame(params, client):
+    '''
+    Downloads one query (which must fit under the row limit) into a typed DataFrame.
+    We ask for CSV so the body can be parsed as it streams in, which means the
+    http_fetch span includes the parse span inside it
+    '''
+    with span("http_fetch") as record, _translate_errors():
+        with client.stream("api_GET/", {**params, "format": "CSV"}) as response:
+
+            #Errors still come back as JSON
+            if response.status_code >= 400 or "json" in response.headers.get("Content-Type", ""):
+                _raise_for_error(response.json())
+                raise QuickstatsError("Some other error")
+
+            response.raw.decode_content = True
+            df = read_quickstats_csv(response.raw)
+
+            #Bytes as they came over the wire, before gzip was undone
+            record["bytes"] = response.raw.tell()
+            record["rows"] = len(df)
+
+            return df
+
+
+async def afetch_frame(params, client):
+    return await asyncio.to_thread(fetch_frame, params, client)
+
+
+def _split_values(params, dim, vocabulary):
+    '''
+    Values to split a query on for one dimension, or [] if that dimension is already pinned down
+    '''
+    if dim in params:
+        return []
+
+    if dim == "year":
+        if "year__EQ" in params:
+            return []
+
+        years = sorted(int(year) for year in (vocabulary.values("year") or []) if str(year).isdigit())
+        low = int(params.get("year__GE", params.get("year__GT", -1))) + ("year__GT" in params)
+        high = int(params.get("year__LE", params.get("year__LT", 10000))) - ("year__LT" in params)
+
+        return [str(year) for year in years if low <= year <= high]
+
+    if dim == "state_alpha":
+        if params.get("agg_level_desc") == "NATIONAL":
+            return []
+
+        return sorted(vocabulary.values("state_alpha") or [])
+
+    return []
+
+
+async def _asplit_query(params, client, vocabulary, count):
+    if count == 0:
+        return []
+
+    if count <= row_limit:
+        return [params]
+
+    for dim in split_dims:
+        values = _split_values(params, dim, vocabulary)
+        if not values:
+            continue
+
+        #Range operators on the dimension we are pinning down would fight the exact value
+        base = {name: value for name, value in params.items() if not name.startswith(f"{dim}__")}
+        pieces = [{**base, dim: value} for value in values]
+
+        counts = await asyncio.gather(*(aget_count(piece, client) for piece in pieces))
+        chunk_lists = await asyncio.gather(*(_asplit_query(piece, client, vocabulary, piece_count)
+                                             for piece, piece_count in zip(pieces, counts)))
+
+        return [chunk for chunks in chunk_lists for chunk in chunks]
+
+    raise QuickstatsError("Too much data requested")
+
+
+def split_query(params, client, vocabulary, count=None):
+    '''
+    Splits a query into pieces that each fit under the row limit, dropping empty pieces.
+    Raises QuickstatsError("Too much data requested") when no split gets it under the cap
+    '''
+    if count is None:
+        count = get_count(params, client)
+
+    return asyncio.run(_asplit_query(params, client, vocabulary, count))
+
+
+def fetch_chunked(chunks, client):
+    '''
+    Pulls every chunk concurrently (bounded by the client) and stacks them into one DataFrame
+    '''
+    async def fetch_all():
+        return await asyncio.gather(*(afetch_frame(chunk, client) for chunk in chunks))
+
+    return concat_frames(asyncio.run(fetch_all()))
@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+import pandas as pd
+
+from telemetry import span
+
+
+
+#______________________Configuration items___________________________________#
+#Quickstats columns that are not low-cardinality text. Everything else is parsed straight
+#into a categorical so 50k rows of "SURVEY"/"CROPS"/"FIELD CROPS" cost one small int each
+text_columns = {"Value": str, "CV (%)": str}
+integer_columns = ("year", "begin_code", "end_code")
+
+#Columns holding numbers that Quickstats formats for people ("1,234", " (D)")
+value_columns = ("Value", "CV (%)")
+
+#(Z) means "less than half the unit shown", which we count as zero. Every other
+#parenthesized code ((D) withheld, (NA) not available, (X), (S), (H), (L)) becomes missing
+zero_codes = {"(Z)"}
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def read_quickstats_csv(stream):
+    '''
+    Parses a Quickstats CSV response as it streams in, typed and cleaned in one go
+    '''
+    with span("parse") as record:
+        df = pd.read_csv(stream, dtype=defaultdict(lambda: "category", text_columns),
+                         keep_default_na=False, na_values=[""])
+
+        for column in integer_columns:
+            if column in df.columns:
+                df[column] = pd.to_numeric(df[column].astype(str), errors="coerce", downcast="integer")
+
+        record["rows"] = len(df)
+
+    return clean_values(df)
+
+
+def clean_values(df):
+    '''
+    Turns Value and CV (%) into numbers in one vectorized pass. The Quickstats code that
+    replaced a number, if any, is kept next to it in a "<column>_code" categorical
+    '''
+    with span("clean", rows=len(df)):
+        for column in value_columns:
+            if column not in df.columns:
+                continue
+
+            raw = df[column].astype(str).str.strip()
+            is_code = raw.str.startswith("(")
+
+            numbers = pd.to_numeric(raw.str.replace(",", "", regex=False).mask(is_code), errors="coerce")
+            numbers[raw.isin(zero_codes)] = 0
+
+            df[column] = numbers
+            df[f"{column}_code"] = raw.where(is_code).astype("category")
+
+    return df
+
+
+def redacted_share(df):
+    '''
+    Share of rows whose Value was withheld to avoid disclosing individual operations
+    '''
+    if "Value_code" not in df.columns or len(df) == 0:
+        return 0.0
+
+    return float((df["Value_code"] == "(D)").mean())
+
+
+def concat_frames(frames):
+    '''
+    Stacks chunked pulls without letting categoricals with different categories fall back to object
+    '''
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+
+    for column in frames[0].columns:
+        if not isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            continue
+
+        categories = pd.api.types.union_categoricals([df[column] for df in frames if column in df.columns]).categories
+        for df in frames:
+            if column in df.columns:
+                df[column] = df[column].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
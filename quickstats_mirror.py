@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from quickstats_ingest import clean_values, value_columns
+
+
+
+#______________________Configuration items___________________________________#
+#Where the local copy of the Quickstats bulk files lives. Unset means no mirror
+mirror_dir = os.environ.get("AGSTATS_MIRROR_DIR")
+
+#Rows read from a bulk file at a time while ingesting
+ingest_chunk_rows = 500000
+
+#Directory layout: one folder per source, then sector, year and commodity. A source,
+#sector and year folder is what a newer dump replaces. The manifest is _manifest.json,
+#and dumps are staged in _staging-* folders, because pyarrow skips names starting with
+#an underscore
+partition_schema = pa.schema([("source_desc", pa.string()), ("sector_desc", pa.string()), ("year", pa.int32()),
+                              ("commodity_desc", pa.string())])
+
+#Rows are sorted on these inside every file, so Parquet row group statistics let a
+#query on geography or statistic skip most of a partition without reading it
+sort_columns = ["agg_level_desc", "state_alpha", "statisticcat_desc", "county_code"]
+
+#The bulk files spell a few column names differently from the API
+bulk_column_names = {"value": "Value", "cv_%": "CV (%)"}
+
+#Comparison suffixes the API accepts, as pyarrow expressions
+operators = {"": lambda field, value: field == value,
+             "__EQ": lambda field, value: field == value,
+             "__NE": lambda field, value: field != value,
+             "__LT": lambda field, value: field < value,
+             "__LE": lambda field, value: field <= value,
+             "__GT": lambda field, value: field > value,
+             "__GE": lambda field, value: field >= value}
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def _bulk_column(name):
+    name = name.strip().lower()
+    return bulk_column_names.get(name, name)
+
+
+def _to_arrow(chunk):
+    '''
+    One cleaned chunk as an Arrow table. Types are fixed up front (not inferred) so a
+    column that happens to be empty in one chunk can't give its files a different schema
+    '''
+    schema = pa.schema([(column, pa.int32() if column == "year" else pa.float64() if column in value_columns else pa.string())
+                        for column in chunk.columns])
+
+    for column in chunk.columns:
+        if isinstance(chunk[column].dtype, pd.CategoricalDtype):
+            chunk[column] = chunk[column].astype(object)
+
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def _snapshot(path):
+    '''
+    The date in a bulk file's name, qs.crops_20240101.txt.gz gives 20240101
+    '''
+    match = re.search(r"_(\d{8})", os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def _part_key(source, sector, year):
+    return f"{source}|{sector}|{year}"
+
+
+def ingest(paths, root, chunk_rows=ingest_chunk_rows):
+    '''
+    Loads NASS bulk Quickstats dumps (gzipped, tab separated) into a partitioned Parquet
+    dataset under root. A dump replaces what the mirror had for each source, sector and
+    year it holds rows for and leaves the rest alone, so a newer qs.crops snapshot replaces
+    the crops rows while qs.census2022 only replaces the 2022 census. The manifest records
+    which file and snapshot each of those parts came from
+    '''
+    os.makedirs(root, exist_ok=True)
+    manifest_path = os.path.join(root, "_manifest.json")
+    manifest = {"parts": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest["parts"] = json.load(f).get("parts")
+
+    if manifest["parts"] is None:
+        #Written with an older layout, the mirror is rebuilt from the dumps loaded from now on
+        for name in os.listdir(root):
+            if not name.startswith(("_", ".")):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        manifest["parts"] = {}
+
+    for path in paths:
+        #The whole dump is written aside first, then swapped in one part folder at a time
+        staging = os.path.join(root, f"_staging-{uuid.uuid4().hex[:8]}")
+        parts = {}
+
+        try:
+            reader = pd.read_csv(path, sep="\t", dtype=str, chunksize=chunk_rows,
+                                 keep_default_na=False, na_values=[""], encoding="latin-1")
+
+            for index, chunk in enumerate(reader):
+                chunk.columns = [_bulk_column(name) for name in chunk.columns]
+                chunk["year"] = pd.to_numeric(chunk["year"], errors="coerce").astype("Int32")
+                chunk = clean_values(chunk.dropna(subset=["year", "source_desc", "sector_desc"]))
+                chunk = chunk.sort_values([column for column in sort_columns if column in chunk.columns])
+
+                ds.write_dataset(_to_arrow(chunk), staging, format="parquet",
+                                 partitioning=ds.partitioning(partition_schema, flavor="hive"),
+                                 basename_template=f"part-{index}-{{i}}.parquet",
+                                 existing_data_behavior="overwrite_or_ignore")
+
+                for (source, sector, year), rows in chunk.groupby(["source_desc", "sector_desc", "year"]):
+                    loaded = parts.setdefault(_part_key(source, sector, year), {"rows": 0, "commodities": set()})
+                    loaded["rows"] += len(rows)
+                    loaded["commodities"].update(rows["commodity_desc"].dropna().unique())
+
+            #Folder names are the partition values as pyarrow encoded them
+            part_dirs = [os.path.join(source_dir, sector_dir, year_dir)
+                         for source_dir in (os.listdir(staging) if parts else ())
+                         for sector_dir in os.listdir(os.path.join(staging, source_dir))
+                         for year_dir in os.listdir(os.path.join(staging, source_dir, sector_dir))]
+
+            for part_dir in part_dirs:
+                target = os.path.join(root, part_dir)
+                retired = os.path.join(root, f"_retired-{uuid.uuid4().hex[:8]}")
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                if os.path.exists(target):
+                    os.rename(target, retired)
+                os.rename(os.path.join(staging, part_dir), target)
+                shutil.rmtree(retired, ignore_errors=True)
+
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        for key, loaded in parts.items():
+            manifest["parts"][key] = {"path": os.path.abspath(path), "snapshot": _snapshot(path),
+                                      "loaded": time.strftime("%Y-%m-%d %H:%M:%S"), "rows": loaded["rows"],
+                                      "commodities": sorted(loaded["commodities"])}
+
+    manifest["commodities"] = sorted({commodity for part in manifest["parts"].values() for commodity in part["commodities"]})
+    manifest["rows"] = sum(part["rows"] for part in manifest["parts"].values())
+
+    #Replaced in one go, a running app picks it up as the sign to look at the files again
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+    return manifest
+
+
+class QuickstatsMirror:
+    '''
+    Answers Quickstats API parameter sets from the local bulk mirror, with no row limit
+    '''
+
+    def __init__(self, root=mirror_dir):
+        self.root = root
+        self._manifest_mtime = None
+        self._open()
+
+    def _open(self):
+        '''
+        Reads the manifest and lists the files, again whenever a reload changed the manifest
+        '''
+        manifest_path = os.path.join(self.root, "_manifest.json")
+        #A reload replaces the manifest, so it has a new inode even if the clock is coarse
+        stat = os.stat(manifest_path)
+        mtime = (stat.st_ino, stat.st_mtime_ns)
+        if mtime == self._manifest_mtime:
+            return
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        self.commodities = set(manifest["commodities"])
+        self.parts = manifest.get("parts", {})
+        self.dataset = ds.dataset(self.root, format="parquet", partitioning=ds.partitioning(partition_schema, flavor="hive"))
+        self._manifest_mtime = mtime
+
+    def _filter(self, params):
+        '''
+        The params as one pyarrow filter, or None if the mirror can't express one of them
+        '''
+        expression = None
+
+        for name, value in params.items():
+            if name.lower() in ("key", "format"):
+                continue
+
+            column, _, suffix = name.partition("__")
+            suffix = f"__{suffix.upper()}" if suffix else ""
+            if suffix not in operators or column not in self.dataset.schema.names:
+                #LIKE and friends, or a column the dumps don't have, go to the live API
+                return None
+
+            field_type = self.dataset.schema.field(column).type
+            try:
+                if pa.types.is_integer(field_type):
+                    value = int(value)
+                elif pa.types.is_floating(field_type):
+                    value = float(value)
+            except ValueError:
+                #Like year=2020,2021, let Quickstats say what it makes of it
+                return None
+
+            condition = operators[suffix](ds.field(column), value)
+            expression = condition if expression is None else expression & condition
+
+        return expression
+
+    def query(self, params):
+        '''
+        DataFrame for the params, shaped like a live pull, or None if the mirror can't answer
+        '''
+        self._open()
+
+        commodity = params.get("commodity_desc")
+        if commodity is None or commodity not in self.commodities:
+            return None
+
+        expression = self._filter(params)
+        if expression is None:
+            return None
+
+        try:
+            try:
+                table = self.dataset.to_table(filter=expression)
+            except FileNotFoundError:
+                #A reload swapped the files out before it rewrote the manifest
+                self._manifest_mtime = None
+                self._open()
+                table = self.dataset.to_table(filter=self._filter(params))
+
+        except (pa.ArrowException, OSError, TypeError):
+            #A filter Arrow can't evaluate, or files that went away. The live API still can
+            return None
+
+        return table.to_pandas(strings_to_categorical=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load NASS bulk Quickstats dumps into the local mirror")
+    parser.add_argument("dumps", nargs="+", help="bulk files such as qs.crops_20240101.txt.gz")
+    parser.add_argument("--root", default=mirror_dir, help="mirror directory (default: $AGSTATS_MIRROR_DIR)")
+    args = parser.parse_args()
+
+    if not args.root:
+        parser.error("set --root or AGSTATS_MIRROR_DIR")
+
+    manifest = ingest(args.dumps, args.root)
+    snapshots = ", ".join(sorted({f"{os.path.basename(part['path'])} ({part['snapshot'] or 'undated'})"
+                                  for part in manifest["parts"].values()}))
+    print(f"Mirror at {args.root} now has {manifest['rows']} rows across {len(manifest['commodities'])} commodities ({snapshots})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import difflib
+import json
+import os
+import re
+import tempfile
+import time
+from urllib.parse import urlencode, urlsplit, parse_qsl
+
+from quickstats_cache import cache_dir
+
+
+
+#______________________Configuration items___________________________________#
+api_url = "https://quickstats.nass.usda.gov/api/api_GET/"
+
+#Legal parameter values barely move, so keep them for a week
+vocabulary_ttl = 7 * 24 * 60 * 60
+
+#After Quickstats failed to give us a parameter's values, go without them this long
+#(seconds) rather than paying for the client's retries again on every lookup
+vocabulary_retry_after = 5 * 60
+
+#Parameters we check against the Quickstats vocabulary before spending an HTTP call.
+#Operator suffixes like year__GE or commodity_desc__LIKE are not checked
+checked_params = ("source_desc", "sector_desc", "group_desc", "commodity_desc", "statisticcat_desc",
+                  "unit_desc", "agg_level_desc", "state_alpha", "freq_desc", "reference_period_desc")
+
+#The messenger bot talks like a person, Quickstats does not
+commodity_synonyms = {"COW": "CATTLE", "COWS": "CATTLE", "BEEF": "CATTLE", "STEER": "CATTLE", "STEERS": "CATTLE",
+                      "PIG": "HOGS", "PIGS": "HOGS", "PORK": "HOGS", "SWINE": "HOGS", "HOG": "HOGS",
+                      "CHICKEN": "CHICKENS", "POULTRY": "CHICKENS", "BROILERS": "CHICKENS",
+                      "MAIZE": "CORN", "SOYBEAN": "SOYBEANS", "SOY": "SOYBEANS",
+                      "LAMB": "SHEEP", "GOAT": "GOATS", "TURKEY": "TURKEYS",
+                      "EGG": "EGGS", "POTATO": "POTATOES", "TOMATO": "TOMATOES", "PEANUT": "PEANUTS"}
+
+#Checked longest phrase first so "area harvested" wins over "harvested"
+statistic_keywords = {"AREA HARVESTED": "AREA HARVESTED", "ACRES HARVESTED": "AREA HARVESTED", "HARVESTED": "AREA HARVESTED",
+                      "AREA PLANTED": "AREA PLANTED", "ACRES PLANTED": "AREA PLANTED", "PLANTED": "AREA PLANTED",
+                      "AREA BEARING": "AREA BEARING", "ACREAGE": "AREA HARVESTED",
+                      "YIELD": "YIELD", "PRODUCTION": "PRODUCTION", "PRODUCED": "PRODUCTION",
+                      "INVENTORY": "INVENTORY", "HEAD": "INVENTORY", "PRICE": "PRICE RECEIVED",
+                      "SALES": "SALES", "SOLD": "SALES", "OPERATIONS": "OPERATIONS", "FARMS": "OPERATIONS",
+                      "EXPENSE": "EXPENSE", "EXPENSES": "EXPENSE"}
+
+state_names = {"ALABAMA": "AL", "ALASKA": "AK", "ARIZONA": "AZ", "ARKANSAS": "AR", "CALIFORNIA": "CA",
+               "COLORADO": "CO", "CONNECTICUT": "CT", "DELAWARE": "DE", "FLORIDA": "FL", "GEORGIA": "GA",
+               "HAWAII": "HI", "IDAHO": "ID", "ILLINOIS": "IL", "INDIANA": "IN", "IOWA": "IA", "KANSAS": "KS",
+               "KENTUCKY": "KY", "LOUISIANA": "LA", "MAINE": "ME", "MARYLAND": "MD", "MASSACHUSETTS": "MA",
+               "MICHIGAN": "MI", "MINNESOTA": "MN", "MISSISSIPPI": "MS", "MISSOURI": "MO", "MONTANA": "MT",
+               "NEBRASKA": "NE", "NEVADA": "NV", "NEW HAMPSHIRE": "NH", "NEW JERSEY": "NJ", "NEW MEXICO": "NM",
+               "NEW YORK": "NY", "NORTH CAROLINA": "NC", "NORTH DAKOTA": "ND", "OHIO": "OH", "OKLAHOMA": "OK",
+               "OREGON": "OR", "PENNSYLVANIA": "PA", "RHODE ISLAND": "RI", "SOUTH CAROLINA": "SC",
+               "SOUTH DAKOTA": "SD", "TENNESSEE": "TN", "TEXAS": "TX", "UTAH": "UT", "VERMONT": "VT",
+               "VIRGINIA": "VA", "WASHINGTON": "WA", "WEST VIRGINIA": "WV", "WISCONSIN": "WI", "WYOMING": "WY"}
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+class QuickstatsVocabulary:
+    '''
+    Legal values for Quickstats parameters, pulled from get_param_values once and
+    kept on disk next to the response cache
+    '''
+
+    def __init__(self, client, directory=cache_dir, ttl=vocabulary_ttl, retry_after=vocabulary_retry_after):
+        self.client = client
+        self.directory = os.path.join(directory, "vocabulary")
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._values = {}
+        #When each parameter's last lookup failed
+        self._failed = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def values(self, param):
+        '''
+        Returns the set of legal values for a parameter, or None if Quickstats could not tell us
+        '''
+        if param in self._values:
+            return self._values[param]
+
+        path = os.path.join(self.directory, f"{param}.json")
+
+        try:
+            if time.time() - os.stat(path).st_mtime < self.ttl:
+                with open(path) as f:
+                    self._values[param] = set(json.load(f))
+                return self._values[param]
+        except (OSError, ValueError):
+            pass
+
+        if time.time() - self._failed.get(param, float("-inf")) < self.retry_after:
+            return None
+
+        try:
+            values = self.client.get_json("get_param_values/", {"param": param})[param]
+        except Exception:
+            #No vocabulary means no validation, not a failed question
+            self._failed[param] = time.time()
+            return None
+
+        #Unique name, batch runs look up the same parameter from several threads at once
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(sorted(values), f)
+        os.replace(tmp_path, path)
+
+        self._values[param] = set(values)
+        return self._values[param]
+
+
+def _find_commodities(text, vocabulary):
+    '''
+    Every commodity the text mentions
+    '''
+    commodities = vocabulary.values("commodity_desc") or set()
+    found = set()
+
+    #Multi word commodities like "SWEET CORN" have to beat plain "CORN", so they are
+    #taken out of the text once found
+    for commodity in sorted(commodities, key=len, reverse=True):
+        if " " in commodity and re.search(rf"\b{re.escape(commodity)}S?\b", text):
+            found.add(commodity)
+            text = re.sub(rf"\b{re.escape(commodity)}S?\b", " ", text)
+
+    for word in re.findall(r"[A-Z]+", text):
+        for candidate in (commodity_synonyms.get(word), word, word + "S", word.rstrip("S"), word + "ES"):
+            if candidate and candidate in commodities:
+                found.add(candidate)
+                break
+
+    return found
+
+
+def parse_intent(response, vocabulary):
+    '''
+    Turns the messenger bot's "API- ..." idea into Quickstats parameters.
+    Returns None when the idea is missing a commodity, year or geography, names more than
+    one commodity, state or separate year, which one query can't ask for, or is unclear
+    about the geography level. The API bot handles those
+    '''
+    text = response.split("API", 1)[-1].upper()
+    text = re.sub(r"[^A-Z0-9\- ]", " ", text)
+    params = {}
+
+    commodities = _find_commodities(text, vocabulary)
+    if len(commodities) != 1:
+        return None
+    params["commodity_desc"] = commodities.pop()
+
+    years = sorted({int(year) for year in re.findall(r"\b(?:18|19|20)\d{2}\b", text)})
+    #Only a range the text spells out, "2019 and 2021" must not pull 2020 as well
+    year_range = (re.search(r"\b((?:18|19|20)\d{2}) *(?:-|TO|THROUGH|THRU|UNTIL) *((?:18|19|20)\d{2})\b", text)
+                  or re.search(r"\bBETWEEN ((?:18|19|20)\d{2}) AND ((?:18|19|20)\d{2})\b", text))
+    if not years:
+        return None
+    elif len(years) == 1:
+        params["year"] = str(years[0])
+    elif len(years) == 2 and year_range:
+        params["year__GE"] = str(years[0])
+        params["year__LE"] = str(years[-1])
+    else:
+        return None
+
+    states = [alpha for name, alpha in sorted(state_names.items(), key=lambda item: -len(item[0]))
+              if re.search(rf"\b{name}\b", text)]
+    #"West Virginia" also contains "Virginia"
+    if "WV" in states and "VA" in states and not re.search(r"(?<!WEST )\bVIRGINIA\b", text):
+        states.remove("VA")
+    if len(states) > 1:
+        return None
+
+    #"by state", "each state", "state-level", but not the state in "United States"
+    by_state = re.search(r"\bSTATES?\b", re.sub(r"\bUNITED STATES\b", " ", text))
+    #Asked for national totals, as opposed to just saying where
+    national = re.search(r"\b(NATIONAL|NATIONALLY|NATIONWIDE)\b", text)
+    in_us = re.search(r"\b(USA|UNITED STATES|COUNTRY|U S)\b", text)
+
+    if re.search(r"\bCOUNT(Y|IES)\b", text):
+        params["agg_level_desc"] = "COUNTY"
+    elif (states or by_state) and national:
+        return None
+    elif states or by_state:
+        params["agg_level_desc"] = "STATE"
+    elif national or in_us:
+        params["agg_level_desc"] = "NATIONAL"
+    else:
+        return None
+
+    if states:
+        params["state_alpha"] = states[0]
+
+    for keyword, statistic in sorted(statistic_keywords.items(), key=lambda item: -len(item[0])):
+        if re.search(rf"\b{keyword}\b", text):
+            params["statisticcat_desc"] = statistic
+            break
+
+    if re.search(r"\bCENSUS\b", text):
+        params["source_desc"] = "CENSUS"
+    elif re.search(r"\bSURVEY\b", text):
+        params["source_desc"] = "SURVEY"
+
+    if validate_params(params, vocabulary):
+        return None
+
+    return params
+
+
+def validate_params(params, vocabulary):
+    '''
+    Returns a list of (parameter, value, suggestions) for every value Quickstats would reject
+    '''
+    invalid = []
+
+    for param, value in params.items():
+        if param not in checked_params:
+            continue
+
+        legal_values = vocabulary.values(param)
+        if legal_values is None or value in legal_values:
+            continue
+
+        suggestions = difflib.get_close_matches(value.upper(), legal_values, n=3, cutoff=0.6)
+        invalid.append((param, value, suggestions))
+
+    return invalid
+
+
+def link_params(api_link):
+    '''
+    Query parameters of a Quickstats URL the API bot wrote, minus the key
+    '''
+    return {name: value for name, value in parse_qsl(urlsplit(api_link).query) if name.lower() != "key"}
+
+
+def build_url(params):
+    '''
+    Quickstats URL for a parameter set. The key is left as YOUR_API_KEY like the API bot does
+    '''
+    query = urlencode({"key": "YOUR_API_KEY", **params, "format": "JSON"})
+
+    return f"{api_url}?{query}"
+
+
+def invalid_params_message(invalid):
+    '''
+    Retry prompt for the API bot that says exactly which values were wrong
+    '''
+    problems = []
+    for param, value, suggestions in invalid:
+        if suggestions:
+            problems.append(f"{param}={value} is not a valid value, did you mean one of {suggestions}?")
+        else:
+            problems.append(f"{param}={value} is not a valid value")
+
+    return "Please try again, Quickstats does not accept that link: " + " ".join(problems)
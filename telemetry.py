@@ -0,0 +1,145 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from quickstats_cache import cache_dir
+
+
+
+#______________________Configuration items___________________________________#
+#Per 1K token prices for every model the sidebar offers, keyed by OpenAI model ID
+pricing_path = os.environ.get("AGSTATS_PRICING", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing.json"))
+
+#Every finished span is appended here as one JSON line, for whatever collects our metrics
+metrics_path = os.environ.get("AGSTATS_METRICS_PATH", os.path.join(cache_dir, "metrics.jsonl"))
+
+#Spans a session keeps in memory for the sidebar panel
+span_history = 500
+
+#The trace spans are recorded on. Set per script run, and copied into the threads and
+#tasks a chunked pull fans out to, so the fetch code never has to pass it around
+_current_trace = contextvars.ContextVar("agstats_trace", default=None)
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def load_pricing(path=pricing_path):
+    '''
+    {model ID: {"prompt": dollars per 1K prompt tokens, "completion": dollars per 1K completion tokens}}
+    '''
+    with open(path) as f:
+        pricing = json.load(f)
+
+    return {model: prices for model, prices in pricing.items() if not model.startswith("_")}
+
+
+def completion_cost(pricing, model, prompt_tokens, completion_tokens):
+    '''
+    Dollar cost of one completion. A model missing from the table is a configuration
+    mistake, so it raises instead of quietly billing at some other model's rate
+    '''
+    if model not in pricing:
+        raise KeyError(f"No price for {model} in {pricing_path}")
+
+    prices = pricing[model]
+
+    return (prompt_tokens * prices["prompt"] + completion_tokens * prices["completion"]) / 1000
+
+
+class JsonlSink:
+    '''
+    Appends spans to a JSON lines file shared by every session and process on the machine
+    '''
+
+    def __init__(self, path=metrics_path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+
+        #One write call per line keeps lines from different processes whole in append mode
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class Trace:
+    '''
+    Spans for one session. Each span is a dict with the stage, its duration in seconds and
+    whatever the stage knows about its payload (bytes, rows, tokens, cost)
+    '''
+
+    def __init__(self, sinks=(), max_spans=span_history):
+        self.session = uuid.uuid4().hex[:12]
+        self.sinks = list(sinks)
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def activate(self):
+        '''
+        Makes this the trace that span() records on, for the rest of this script run
+        '''
+        _current_trace.set(self)
+
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        '''
+        Times the with block. The yielded dict can be filled in with bytes, rows, tokens, ...
+        '''
+        record = {"session": self.session, "stage": stage, "start": time.time(), **fields}
+        start = time.perf_counter()
+
+        try:
+            yield record
+
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+
+        finally:
+            record["duration"] = time.perf_counter() - start
+            self.record(record)
+
+    def record(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+        for sink in self.sinks:
+            sink.write(record)
+
+    def summary(self):
+        '''
+        Totals per stage, in the order the stages first ran
+        '''
+        stages = {}
+
+        with self._lock:
+            spans = list(self.spans)
+
+        for record in spans:
+            totals = stages.setdefault(record["stage"], {"stage": record["stage"], "calls": 0, "seconds": 0.0,
+                                                        "bytes": 0, "rows": 0, "tokens": 0, "cost": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] += record["duration"]
+            for field in ("bytes", "rows", "tokens", "cost"):
+                totals[field] += record.get(field) or 0
+
+        return list(stages.values())
+
+
+def span(stage, **fields):
+    '''
+    A span on the current trace. Outside the app (batch runs, notebooks) there is no trace
+    and this only hands back a dict nobody reads
+    '''
+    trace = _current_trace.get()
+    if trace is None:
+        return contextlib.nullcontext({"stage": stage, **fields})
+
+    return trace.span(stage, **fields)
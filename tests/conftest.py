@@ -0,0 +1,90 @@
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qsl
+
+import pytest
+
+#The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+class QuickstatsStub:
+    '''
+    Local stand-in for the Quickstats API. A test sets respond(endpoint, params) to return
+    (status, body) and reads back the requests and the most that were in flight at once.
+    Dict and list bodies are sent as JSON, strings as CSV
+    '''
+
+    def __init__(self):
+        self.respond = lambda endpoint, params: (200, {"count": 0})
+        self.delay = 0
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                with stub._lock:
+                    stub.requests.append((url.path.rsplit("/api/", 1)[-1], params))
+                    stub.in_flight += 1
+                    stub.peak = max(stub.peak, stub.in_flight)
+
+                try:
+                    time.sleep(stub.delay)
+                    status, body = stub.respond(url.path.rsplit("/api/", 1)[-1], params)
+                    content_type = "text/csv" if isinstance(body, str) else "application/json"
+                    body = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                except (BrokenPipeError, ConnectionResetError):
+                    #The client gave up waiting
+                    pass
+
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def quickstats_stub():
+    stub = QuickstatsStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture(scope="session")
+def sample_csv():
+    '''
+    The recorded Quickstats rows the benchmark serves, header first
+    '''
+    with open(os.path.join(fixtures_dir, "quickstats_sample.csv"), encoding="utf-8") as f:
+        return f.read().splitlines()
@@ -0,0 +1,33 @@
+import pickle
+
+from analysis_cache import AnalysisCache
+from completion_cache import MemoryBackend, SqliteBackend
+
+
+artifacts = [("image", b"\x89PNG\r\n"), ("table", b"\xff\xff\x00"), ("chart", "bar_chart", b"\x00\x01"), ("text", "Done")]
+
+
+def test_round_trip_through_disk(tmp_path):
+    AnalysisCache([SqliteBackend(str(tmp_path / "analyses.sqlite"))]).put("key", artifacts)
+
+    assert AnalysisCache([MemoryBackend(), SqliteBackend(str(tmp_path / "analyses.sqlite"))]).get("key") == artifacts
+
+
+def test_pickled_entries_are_not_loaded(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "analyses.sqlite"))
+    backend.put("key", pickle.dumps(artifacts))
+
+    assert AnalysisCache([backend]).get("key") is None
+
+
+def test_redraws_leave_the_counters_alone():
+    cache = AnalysisCache([MemoryBackend()])
+    cache.put("key", artifacts)
+
+    assert cache.get("key", count=False) == artifacts
+    assert cache.get("other", count=False) is None
+    assert (cache.hits, cache.misses) == (0, 0)
+
+    cache.get("key")
+    cache.get("other")
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,33 @@
+from chat_history import ChatHistory
+
+
+prompt = [{"role": "user", "content": "instructions"}, {"role": "assistant", "content": "OK"}]
+
+
+def test_pinned_turns_survive_trimming():
+    history = ChatHistory(prompt, max_tokens=50)
+    history.append("user", "what analysis could I do?")
+    history.append("assistant", "Idea 1 ... Idea 2 ... Idea 3 ```python\nst.write(df)\n```")
+    history.pin()
+
+    for number in range(5):
+        history.append("user", f"{number} " + "x" * 100)
+        history.append("assistant", "y" * 100)
+        history.trim(summarize=lambda summary, turns: f"{len(turns)} more turns")
+
+    messages = history.messages()
+    assert messages[:4] == prompt + history.pinned
+    assert "Idea 2" in messages[3]["content"]
+    assert messages[4]["content"].startswith("Summary of our conversation so far")
+
+
+def test_pinning_again_replaces_the_earlier_pin():
+    history = ChatHistory(prompt)
+    history.append("user", "ideas for corn")
+    history.append("assistant", "corn ideas")
+    history.pin()
+    history.append("user", "ideas for wheat")
+    history.append("assistant", "wheat ideas")
+    history.pin()
+
+    assert [message["content"] for message in history.messages()] == ["instructions", "OK", "ideas for wheat", "wheat ideas"]
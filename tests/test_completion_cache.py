@@ -0,0 +1,27 @@
+import time
+
+from completion_cache import CompletionCache, MemoryBackend, SqliteBackend
+
+
+def test_memory_entries_expire():
+    backend = MemoryBackend(ttl=60)
+    backend.put("fresh", "reply")
+    backend.put("stale", "reply", created=time.time() - 61)
+
+    cache = CompletionCache([backend])
+    assert cache.get("fresh") == "reply"
+    assert cache.get("stale") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_copied_from_disk_keep_their_age(tmp_path):
+    disk = SqliteBackend(str(tmp_path / "completions.sqlite"), ttl=60)
+    disk.put("key", "reply", created=time.time() - 59.5)
+    memory = MemoryBackend(ttl=60)
+    cache = CompletionCache([memory, disk])
+
+    assert cache.get("key") == "reply"
+    assert memory.get("key")[0] == "reply"
+
+    time.sleep(0.6)
+    assert cache.get("key") is None
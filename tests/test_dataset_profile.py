@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from chat_history import approx_tokens
+from dataset_profile import profile_dataset
+
+
+def test_constant_columns_are_listed_last():
+    df = pd.DataFrame({"year": [2019, 2020, 2021],
+                       "commodity_desc": ["CORN"] * 3,
+                       "unit_desc": ["BU / ACRE", None, "BU / ACRE"],
+                       "Value": [170.0, 180.5, 175.0]})
+
+    profile = profile_dataset(df).splitlines()
+
+    assert profile[0] == "3 rows. Columns that vary:"
+    assert "- year: numbers from 2,019 to 2,021" in profile
+    assert profile[-1] == "Same on every row: unit_desc=BU / ACRE or missing, commodity_desc=CORN"
+
+
+def test_missing_values_show_their_codes():
+    df = pd.DataFrame({"Value": [1.0, np.nan, np.nan, 4.0],
+                       "Value_code": pd.Categorical([None, "(D)", "(NA)", None])})
+
+    assert profile_dataset(df).splitlines()[1] == "- Value: numbers from 1 to 4; 50% missing: (D) 25%, (NA) 25%"
+
+
+def test_lines_past_the_budget_are_left_out():
+    df = pd.DataFrame({f"column_{number}": range(number, number + 10) for number in range(30)})
+
+    full = profile_dataset(df, max_tokens=10000).splitlines()
+    short = profile_dataset(df, max_tokens=100)
+    lines = short.splitlines()
+
+    assert len(full) == 31
+    assert lines[0] == full[0] and lines[-1] == f"({31 - len(lines) + 1} more lines left out for length)"
+    assert sum(approx_tokens(line) for line in lines[:-1]) <= 100
+
+
+def test_empty_dataset():
+    assert profile_dataset(pd.DataFrame()) == "The dataset is empty."
+    assert profile_dataset(None) == "The dataset is empty."
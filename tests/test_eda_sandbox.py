@@ -0,0 +1,123 @@
+import glob
+import os
+import uuid
+
+import pandas as pd
+import pytest
+
+import eda_sandbox
+from eda_sandbox import EdaSandbox, read_table
+
+
+@pytest.fixture(scope="module")
+def sandbox(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(eda_sandbox, "share_dir", str(tmp_path_factory.mktemp("sandbox")))
+        sandbox = EdaSandbox(workers=1)
+        yield sandbox
+        sandbox.close()
+
+
+@pytest.fixture
+def dataset():
+    df = pd.DataFrame({"year": [2019, 2019, 2020, 2020],
+                       "statisticcat_desc": pd.Categorical(["YIELD", "AREA HARVESTED"] * 2),
+                       "Value": [180.0, 1000.0, 170.0, 2000.0]})
+    #A fresh fingerprint per test, so nothing cached by an earlier test is found
+    return df, uuid.uuid4().hex
+
+
+def by_year(sandbox, code, dataset):
+    df, fingerprint = dataset
+    artifacts = sandbox.run(code + "\nst.dataframe(cached(lambda: df.groupby('year')['Value'].sum()))", df, fingerprint)
+
+    return read_table(artifacts[0][1])["Value"].tolist()
+
+
+def test_cached_follows_a_filtered_df(sandbox, dataset):
+    assert by_year(sandbox, "df = df[df.statisticcat_desc == 'YIELD']", dataset) == [180.0, 170.0]
+    assert by_year(sandbox, "df = df[df.statisticcat_desc == 'AREA HARVESTED']", dataset) == [1000.0, 2000.0]
+    assert not glob.glob(os.path.join(eda_sandbox.share_dir, f"{dataset[1]}-*.arrow"))
+
+
+def test_cached_follows_a_df_changed_in_place(sandbox, dataset):
+    assert by_year(sandbox, "df['Value'] = df['Value'] * 2", dataset) == [2360.0, 4340.0]
+    assert by_year(sandbox, "df.drop(index=[0, 2], inplace=True)", dataset) == [1000.0, 2000.0]
+
+
+def test_cached_shares_frames_from_the_untouched_df(sandbox, dataset):
+    assert by_year(sandbox, "", dataset) == [1180.0, 2170.0]
+    assert len(glob.glob(os.path.join(eda_sandbox.share_dir, f"{dataset[1]}-*.arrow"))) == 1
+    assert by_year(sandbox, "", dataset) == [1180.0, 2170.0]
+
+
+def test_layout_calls_record_what_is_shown_inside(sandbox, dataset):
+    df, fingerprint = dataset
+    code = """col1, col2 = st.columns(2)
+col1.metric("Rows", len(df))
+with col2:
+    st.write("by year")
+tab, = st.tabs(["Table"])
+with tab, st.expander("Data"):
+    st.dataframe(df)
+year = st.selectbox("Year", [2019, 2020])
+st.markdown(f"Picked {year}")"""
+    artifacts = sandbox.run(code, df, fingerprint)
+
+    assert [artifact[0] for artifact in artifacts] == ["text", "text", "table", "text"]
+    assert artifacts[0][1] == "**Rows**: 4" and artifacts[3][1] == "Picked 2019"
+
+
+def test_unsupported_display_calls_are_reported(sandbox, dataset):
+    df, fingerprint = dataset
+
+    with pytest.raises(eda_sandbox.EdaError, match="st.plotly_chart is not supported"):
+        sandbox.run("st.plotly_chart(None)", df, fingerprint)
+
+
+def test_files_in_use_are_not_evicted(sandbox, monkeypatch):
+    monkeypatch.setattr(eda_sandbox, "max_published", 1)
+    df = pd.DataFrame({"Value": [1.0]})
+
+    held = sandbox.publish(df, uuid.uuid4().hex)
+    other = sandbox.publish(df, uuid.uuid4().hex)
+    assert os.path.exists(held) and os.path.exists(other)
+
+    sandbox.release(other)
+    assert os.path.exists(held) and not os.path.exists(other)
+
+    sandbox.release(held)
+    assert os.path.exists(held)
+    sandbox.release(sandbox.publish(df, uuid.uuid4().hex))
+    assert not os.path.exists(held)
+
+
+def test_only_datasets_the_code_reads_are_published(sandbox, dataset):
+    df, fingerprint = dataset
+    others = {name: (df.assign(Value=df["Value"] * number), uuid.uuid4().hex) for number, name in enumerate(["a", "b"], 2)}
+
+    artifacts = sandbox.run("st.write(datasets['b']['Value'].sum())", df, fingerprint, datasets=others)
+
+    assert artifacts[0][1] == str(df["Value"].sum() * 3)
+    assert not os.path.exists(os.path.join(eda_sandbox.share_dir, f"{others['a'][1]}.arrow"))
+
+
+def test_close_removes_published_files(monkeypatch, tmp_path, dataset):
+    monkeypatch.setattr(eda_sandbox, "share_dir", str(tmp_path))
+    sandbox = EdaSandbox(workers=1)
+    try:
+        assert by_year(sandbox, "", dataset) == [1180.0, 2170.0]
+        assert len(os.listdir(tmp_path)) == 2
+    finally:
+        sandbox.close()
+
+    assert not os.listdir(tmp_path)
+
+
+def test_removed_files_are_published_again(sandbox, dataset):
+    df, fingerprint = dataset
+    sandbox.release(sandbox.publish(df, fingerprint))
+    #Another app process sharing the directory closed its sandbox
+    os.remove(os.path.join(eda_sandbox.share_dir, f"{fingerprint}.arrow"))
+
+    assert by_year(sandbox, "", dataset) == [1180.0, 2170.0]
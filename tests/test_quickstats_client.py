@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+from quickstats_client import QuickstatsClient
+from quickstats_fetch import QuickstatsError, get_count, fetch_frame, split_query, fetch_chunked, row_limit
+
+
+class Vocabulary:
+    def values(self, param):
+        return {"year": ["2018", "2019", "2020"], "state_alpha": ["IA", "IL", "NE"]}.get(param)
+
+
+def client_for(stub, **kwargs):
+    return QuickstatsClient("test-key", base_url=stub.url, **{"backoff_factor": 0, **kwargs})
+
+
+def test_retries_503_with_backoff(quickstats_stub):
+    failures = iter([(503, {}), (503, {})])
+    quickstats_stub.respond = lambda endpoint, params: next(failures, (200, {"count": 7}))
+
+    with client_for(quickstats_stub, backoff_factor=0.1) as client:
+        start = time.perf_counter()
+        assert get_count({"commodity_desc": "CORN"}, client) == 7
+
+    #No wait before the first retry, backoff_factor * 2 before the second
+    assert time.perf_counter() - start >= 0.2
+    assert len(quickstats_stub.requests) == 3
+    assert quickstats_stub.requests[0] == ("get_counts/", {"key": "test-key", "commodity_desc": "CORN"})
+
+
+def test_gives_up_after_max_retries(quickstats_stub):
+    quickstats_stub.respond = lambda endpoint, params: (503, {})
+
+    with client_for(quickstats_stub, max_retries=2) as client:
+        with pytest.raises(QuickstatsError, match="Some other error"):
+            get_count({"commodity_desc": "CORN"}, client)
+
+        with pytest.raises(QuickstatsError, match="Some other error"):
+            fetch_frame({"commodity_desc": "CORN"}, client)
+
+    assert len(quickstats_stub.requests) == 6
+
+
+def test_timeout_is_reported(quickstats_stub):
+    quickstats_stub.delay = 1
+
+    with client_for(quickstats_stub, read_timeout=0.1, max_retries=0) as client:
+        with pytest.raises(QuickstatsError, match="Quickstats timed out"):
+            get_count({"commodity_desc": "CORN"}, client)
+
+        with pytest.raises(QuickstatsError, match="Quickstats timed out"):
+            fetch_frame({"commodity_desc": "CORN"}, client)
+
+
+def test_timeouts_are_not_retried(quickstats_stub):
+    quickstats_stub.delay = 0.5
+
+    #The default retries, which only cover 429 and 5xx
+    with client_for(quickstats_stub, read_timeout=0.1) as client:
+        start = time.perf_counter()
+        with pytest.raises(QuickstatsError, match="Quickstats timed out"):
+            get_count({"commodity_desc": "CORN"}, client)
+
+    assert time.perf_counter() - start < 0.4
+    assert len(quickstats_stub.requests) == 1
+
+
+def test_concurrency_is_capped(quickstats_stub, sample_csv):
+    quickstats_stub.delay = 0.05
+    quickstats_stub.respond = lambda endpoint, params: ((200, {"count": int(params["year"])}) if endpoint == "get_counts/"
+                                                        else (200, "\n".join(sample_csv)))
+
+    with client_for(quickstats_stub, max_concurrency=2) as client:
+        counts = asyncio.run(client.agather_json("get_counts/", [{"year": str(year)} for year in range(2015, 2021)]))
+        assert [count["count"] for count in counts] == list(range(2015, 2021))
+        assert quickstats_stub.peak == 2
+
+        quickstats_stub.peak = 0
+        df = fetch_chunked([{"year": str(year)} for year in range(2015, 2021)], client)
+        assert len(df) == 6 * (len(sample_csv) - 1)
+        assert quickstats_stub.peak == 2
+
+
+def test_oversized_queries_are_split_and_stacked(quickstats_stub, sample_csv):
+    #2018 and 2019 fit, 2020 has to be split again by state, and NE has nothing that year
+    counts = {"2018": 40000, "2019": 45000, "2020": 70000}
+    state_counts = {"IA": 40000, "IL": 30000, "NE": 0}
+
+    def respond(endpoint, params):
+        if endpoint == "api_GET/":
+            return 200, "\n".join(sample_csv)
+        if "state_alpha" in params:
+            return 200, {"count": state_counts[params["state_alpha"]]}
+        if "year" in params:
+            return 200, {"count": counts[params["year"]]}
+        return 200, {"count": sum(counts.values())}
+
+    quickstats_stub.respond = respond
+    query = {"commodity_desc": "CORN", "year__GE": "2018", "agg_level_desc": "STATE"}
+
+    with client_for(quickstats_stub) as client:
+        chunks = split_query(query, client, Vocabulary())
+
+        assert chunks == [{"commodity_desc": "CORN", "agg_level_desc": "STATE", "year": "2018"},
+                          {"commodity_desc": "CORN", "agg_level_desc": "STATE", "year": "2019"},
+                          {"commodity_desc": "CORN", "agg_level_desc": "STATE", "year": "2020", "state_alpha": "IA"},
+                          {"commodity_desc": "CORN", "agg_level_desc": "STATE", "year": "2020", "state_alpha": "IL"}]
+
+        df = fetch_chunked(chunks, client)
+        assert len(df) == 4 * (len(sample_csv) - 1)
+        assert df["Value"].dtype.kind == "f"
+
+
+def test_queries_no_split_can_fix_are_refused(quickstats_stub):
+    quickstats_stub.respond = lambda endpoint, params: (200, {"count": row_limit + 1})
+
+    with client_for(quickstats_stub) as client:
+        with pytest.raises(QuickstatsError, match="Too much data requested"):
+            split_query({"commodity_desc": "CORN", "year": "2020", "agg_level_desc": "NATIONAL"}, client, Vocabulary())
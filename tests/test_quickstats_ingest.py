@@ -0,0 +1,65 @@
+import io
+import math
+
+import pandas as pd
+
+from quickstats_ingest import concat_frames, read_quickstats_csv, redacted_share
+
+
+#Shaped like an API response, one row per way Quickstats writes a value
+sample = '''source_desc,state_alpha,year,Value,CV (%)
+SURVEY,IA,2020,"1,234",1.5
+SURVEY,IL,2020,                 (D),(H)
+SURVEY,IN,2020,(NA),
+CENSUS,NE,2017,(Z),(L)
+CENSUS,KS,2017,,2.0
+'''
+
+
+def read(text=sample):
+    return read_quickstats_csv(io.StringIO(text))
+
+
+def test_values_become_numbers():
+    df = read()
+    values = df["Value"].tolist()
+
+    assert values[0] == 1234.0 and values[3] == 0.0
+    assert all(math.isnan(value) for value in (values[1], values[2], values[4]))
+    assert df["CV (%)"].tolist()[0] == 1.5 and math.isnan(df["CV (%)"].tolist()[1])
+
+
+def test_codes_are_kept_next_to_the_value():
+    df = read()
+
+    assert isinstance(df["Value_code"].dtype, pd.CategoricalDtype)
+    assert df["Value_code"].astype(object).fillna("").tolist() == ["", "(D)", "(NA)", "(Z)", ""]
+    assert df["CV (%)_code"].astype(object).fillna("").tolist() == ["", "(H)", "", "(L)", ""]
+
+
+def test_columns_are_typed():
+    df = read()
+
+    assert isinstance(df["source_desc"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_integer_dtype(df["year"])
+
+
+def test_redacted_share():
+    assert redacted_share(read()) == 0.2
+    assert redacted_share(pd.DataFrame({"Value": [1.0]})) == 0.0
+    assert redacted_share(read(sample.splitlines()[0] + "\n")) == 0.0
+
+
+def test_concat_frames_unions_categories_across_chunks():
+    lines = sample.splitlines()
+    first = read("\n".join(lines[:3]) + "\n")
+    second = read("\n".join(lines[:1] + lines[3:]) + "\n")
+    empty = read(lines[0] + "\n")
+
+    df = concat_frames([first, empty, second])
+
+    assert len(df) == 5
+    assert isinstance(df["source_desc"].dtype, pd.CategoricalDtype)
+    assert set(df["source_desc"].cat.categories) == {"SURVEY", "CENSUS"}
+    assert df["state_alpha"].tolist() == ["IA", "IL", "IN", "NE", "KS"]
+    assert concat_frames([empty]).empty
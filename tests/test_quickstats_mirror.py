@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+
+import pyarrow as pa
+import pytest
+
+from quickstats_mirror import QuickstatsMirror, ingest
+
+
+bulk_columns = ["SOURCE_DESC", "SECTOR_DESC", "COMMODITY_DESC", "STATISTICCAT_DESC", "UNIT_DESC",
+                "AGG_LEVEL_DESC", "STATE_ALPHA", "COUNTY_CODE", "YEAR", "VALUE", "CV_%"]
+
+crop_rows = [["SURVEY", "CROPS", "CORN", "YIELD", "BU / ACRE", "STATE", "IA", "", "2019", "198", ""],
+             ["SURVEY", "CROPS", "CORN", "YIELD", "BU / ACRE", "STATE", "IL", "", "2019", "181", ""],
+             ["SURVEY", "CROPS", "CORN", "AREA HARVESTED", "ACRES", "STATE", "IA", "", "2019", "12,900,000", "1.2"],
+             ["SURVEY", "CROPS", "CORN", "YIELD", "BU / ACRE", "STATE", "IA", "", "2020", "(D)", ""],
+             ["SURVEY", "CROPS", "SOYBEANS", "YIELD", "BU / ACRE", "STATE", "IA", "", "2019", "56", ""]]
+
+animal_rows = [["SURVEY", "ANIMALS & PRODUCTS", "CATTLE", "INVENTORY", "HEAD", "STATE", "IA", "", "2019", "3,850,000", ""]]
+
+
+def write_dump(directory, name, rows):
+    path = os.path.join(directory, name)
+    with gzip.open(path, "wt", encoding="latin-1") as f:
+        for row in [bulk_columns] + rows:
+            f.write("\t".join(row) + "\n")
+
+    return path
+
+
+@pytest.fixture
+def mirror_root(tmp_path):
+    #Small chunks, so partitions get parts from several chunks
+    ingest([write_dump(tmp_path, "qs.crops_20240101.txt.gz", crop_rows),
+            write_dump(tmp_path, "qs.animals_products_20240101.txt.gz", animal_rows)],
+           str(tmp_path / "mirror"), chunk_rows=2)
+
+    return str(tmp_path / "mirror")
+
+
+def test_ingest_and_query(mirror_root):
+    with open(os.path.join(mirror_root, "_manifest.json")) as f:
+        manifest = json.load(f)
+
+    assert manifest["rows"] == 6
+    assert manifest["commodities"] == ["CATTLE", "CORN", "SOYBEANS"]
+    assert manifest["parts"]["SURVEY|CROPS|2019"]["snapshot"] == "20240101"
+    assert manifest["parts"]["SURVEY|CROPS|2019"]["rows"] == 4
+
+    df = QuickstatsMirror(mirror_root).query({"key": "abc", "commodity_desc": "CORN", "year": "2019",
+                                              "statisticcat_desc": "YIELD", "format": "JSON"})
+    assert sorted(df["state_alpha"]) == ["IA", "IL"]
+    assert sorted(df["Value"]) == [181.0, 198.0]
+
+
+def test_operator_filters(mirror_root):
+    mirror = QuickstatsMirror(mirror_root)
+
+    df = mirror.query({"commodity_desc": "CORN", "year__GE": "2020"})
+    assert df["year"].tolist() == [2020]
+    assert df["Value"].isna().all() and df["Value_code"].tolist() == ["(D)"]
+
+    df = mirror.query({"commodity_desc": "CORN", "state_alpha__NE": "IA"})
+    assert df["state_alpha"].tolist() == ["IL"]
+
+    df = mirror.query({"commodity_desc": "CORN", "statisticcat_desc": "AREA HARVESTED"})
+    assert df["Value"].tolist() == [12900000.0]
+
+    #What the mirror can't answer goes to the live API
+    assert mirror.query({"commodity_desc": "CORN", "short_desc__LIKE": "CORN%"}) is None
+    assert mirror.query({"commodity_desc": "WHEAT"}) is None
+    assert mirror.query({"year": "2019"}) is None
+
+
+def test_reload_replaces_the_sector(mirror_root, tmp_path):
+    mirror = QuickstatsMirror(mirror_root)
+    query = {"commodity_desc": "CORN", "year": "2019", "statisticcat_desc": "YIELD"}
+    assert len(mirror.query(query)) == 2
+
+    #A newer snapshot with the same rows, one value revised and soybeans gone
+    newer = [row.copy() for row in crop_rows if row[2] != "SOYBEANS"]
+    newer[0][9] = "200"
+    manifest = ingest([write_dump(tmp_path, "qs.crops_20250101.txt.gz", newer)], mirror_root, chunk_rows=2)
+
+    assert manifest["parts"]["SURVEY|CROPS|2019"]["snapshot"] == "20250101"
+    assert manifest["parts"]["SURVEY|ANIMALS & PRODUCTS|2019"]["snapshot"] == "20240101"
+    assert manifest["rows"] == 5
+    assert manifest["commodities"] == ["CATTLE", "CORN"]
+
+    #The mirror that was already open sees the new snapshot
+    assert sorted(mirror.query(query)["Value"]) == [181.0, 200.0]
+    assert mirror.query({"commodity_desc": "SOYBEANS"}) is None
+    assert len(mirror.query({"commodity_desc": "CATTLE"})) == 1
+    assert not [name for name in os.listdir(mirror_root) if name.startswith(("_staging", "_retired"))]
+
+
+def test_a_dump_spanning_sectors_only_replaces_its_own_rows(mirror_root, tmp_path):
+    census = [["CENSUS", "CROPS", "CORN", "AREA HARVESTED", "ACRES", "STATE", "IA", "", "2022", "13,000,000", ""],
+              ["CENSUS", "ANIMALS & PRODUCTS", "CATTLE", "INVENTORY", "HEAD", "STATE", "IA", "", "2022", "3,700,000", ""]]
+    manifest = ingest([write_dump(tmp_path, "qs.census2022.txt.gz", census)], mirror_root)
+
+    assert manifest["rows"] == 8
+    assert manifest["parts"]["CENSUS|CROPS|2022"]["path"].endswith("qs.census2022.txt.gz")
+
+    mirror = QuickstatsMirror(mirror_root)
+    assert len(mirror.query({"commodity_desc": "CORN", "source_desc": "SURVEY"})) == 4
+    assert mirror.query({"commodity_desc": "CORN", "source_desc": "CENSUS"})["Value"].tolist() == [13000000.0]
+    assert len(mirror.query({"commodity_desc": "CATTLE"})) == 2
+
+
+def test_params_the_mirror_cant_evaluate_go_to_the_live_api(mirror_root):
+    mirror = QuickstatsMirror(mirror_root)
+
+    assert mirror.query({"commodity_desc": "CORN", "year": "2020,2021"}) is None
+    assert mirror.query({"commodity_desc": "CORN", "Value__GE": "lots"}) is None
+    assert mirror.query({"commodity_desc": "CORN", "CV (%)__GT": "1"}) is not None
+
+
+def test_arrow_errors_go_to_the_live_api(mirror_root, monkeypatch):
+    mirror = QuickstatsMirror(mirror_root)
+
+    class Dataset:
+        schema = mirror.dataset.schema
+
+        def to_table(self, filter=None):
+            raise pa.ArrowInvalid("cannot compare")
+
+    monkeypatch.setattr(mirror, "dataset", Dataset())
+    assert mirror.query({"commodity_desc": "CORN"}) is None
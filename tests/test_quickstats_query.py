@@ -0,0 +1,64 @@
+import pytest
+
+from quickstats_client import QuickstatsClient
+from quickstats_query import QuickstatsVocabulary, parse_intent
+
+
+class Vocabulary:
+    def values(self, param):
+        return {"commodity_desc": {"PEAS", "BEANS", "CORN", "SWEET CORN", "CATTLE"}}.get(param)
+
+
+@pytest.mark.parametrize("response, params", [
+    ("API- corn yield in Iowa 2015-2020", {"commodity_desc": "CORN", "year__GE": "2015", "year__LE": "2020",
+                                           "agg_level_desc": "STATE", "state_alpha": "IA", "statisticcat_desc": "YIELD"}),
+    ("API- sweet corn production in West Virginia 2019", {"commodity_desc": "SWEET CORN", "year": "2019", "agg_level_desc": "STATE",
+                                                          "state_alpha": "WV", "statisticcat_desc": "PRODUCTION"}),
+    ("API- beef inventory by county in Texas 2018", {"commodity_desc": "CATTLE", "year": "2018", "agg_level_desc": "COUNTY",
+                                                     "state_alpha": "TX", "statisticcat_desc": "INVENTORY"}),
+    ("API- corn yield by state in the United States for 2022", {"commodity_desc": "CORN", "year": "2022", "agg_level_desc": "STATE",
+                                                                "statisticcat_desc": "YIELD"}),
+    ("API- state-level corn yield across the country 2022", {"commodity_desc": "CORN", "year": "2022", "agg_level_desc": "STATE",
+                                                             "statisticcat_desc": "YIELD"}),
+    ("API- corn yield for each state 2022", {"commodity_desc": "CORN", "year": "2022", "agg_level_desc": "STATE",
+                                             "statisticcat_desc": "YIELD"}),
+    ("API- corn yield in Iowa from 2015 to 2020", {"commodity_desc": "CORN", "year__GE": "2015", "year__LE": "2020",
+                                                   "agg_level_desc": "STATE", "state_alpha": "IA", "statisticcat_desc": "YIELD"}),
+    ("API- corn yield in Iowa between 2015 and 2020", {"commodity_desc": "CORN", "year__GE": "2015", "year__LE": "2020",
+                                                       "agg_level_desc": "STATE", "state_alpha": "IA", "statisticcat_desc": "YIELD"}),
+    ("API- corn yield in the United States 2022", {"commodity_desc": "CORN", "year": "2022", "agg_level_desc": "NATIONAL",
+                                                   "statisticcat_desc": "YIELD"}),
+])
+def test_clear_ideas_become_params(response, params):
+    assert parse_intent(response, Vocabulary()) == params
+
+
+@pytest.mark.parametrize("response", [
+    "API- peas and beans production in Kansas 2020",
+    "API- corn yield in West Virginia and Virginia 2019",
+    "API- corn yield in Iowa and Illinois 2019",
+    "API- corn yield in Iowa",
+    "API- wheat yield in Iowa 2019",
+    "API- corn yield in Iowa 2019 and 2021",
+    "API- corn yield in Iowa in 2015, 2018 and 2021",
+    "API- national and state corn yield 2022",
+    "API- corn yield nationally and in Iowa 2022",
+])
+def test_ideas_one_query_cant_answer_go_to_the_api_bot(response):
+    assert parse_intent(response, Vocabulary()) is None
+
+
+def test_vocabulary_failures_are_remembered(quickstats_stub, tmp_path):
+    quickstats_stub.respond = lambda endpoint, params: (503, {})
+
+    with QuickstatsClient("test-key", base_url=quickstats_stub.url, max_retries=1, backoff_factor=0) as client:
+        vocabulary = QuickstatsVocabulary(client, directory=str(tmp_path), retry_after=60)
+
+        assert vocabulary.values("commodity_desc") is None
+        assert vocabulary.values("commodity_desc") is None
+        assert len(quickstats_stub.requests) == 2
+
+        #Back after the wait
+        vocabulary.retry_after = 0
+        quickstats_stub.respond = lambda endpoint, params: (200, {"commodity_desc": ["CORN"]})
+        assert vocabulary.values("commodity_desc") == {"CORN"}
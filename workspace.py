@@ -0,0 +1,178 @@
+import hashlib
+import re
+from collections import OrderedDict
+
+import pandas as pd
+
+from dataset_store import DatasetStore
+
+
+
+#______________________Configuration items___________________________________#
+#Columns that line up pulls from different Quickstats queries
+join_keys = ("year", "state_fips_code", "county_code", "commodity_desc")
+
+#Most datasets a session keeps, and most memory they may use between them. The least
+#recently used one goes first, the active dataset never does
+workspace_max_datasets = 6
+workspace_max_bytes = 512 * 1024 ** 2
+
+#Query parameters that make up a dataset's name, in order
+name_params = ("commodity_desc", "statisticcat_desc", "year", "year__GE", "year__LE", "state_alpha", "agg_level_desc")
+
+
+#______________________FUNCTION MANIA_________________________________________#
+
+def dataset_name(query):
+    '''
+    Short readable name for a pull, like corn_yield_2019_ia
+    '''
+    parts = [str(query[param]) for param in name_params if query.get(param)]
+    name = re.sub(r"[^a-z0-9]+", "_", "_".join(parts).lower()).strip("_")
+
+    return name[:60] or "dataset"
+
+
+def _keys(frames, keys):
+    '''
+    The join keys every frame has values for
+    '''
+    return [key for key in keys if all(key in df.columns and df[key].notna().any() for df in frames)]
+
+
+def align(frames, value="Value", keys=join_keys, agg="mean", how="outer"):
+    '''
+    Lines up several datasets on the keys they share: one row per key combination and one
+    column per dataset holding its value, e.g.
+        align({"acres": datasets["corn_area_harvested_2019"], "yield": datasets["corn_yield_2019"]})
+    Rows within a dataset that share keys are combined with agg, so filter each dataset
+    to a single statistic and unit first
+    '''
+    shared = _keys(frames.values(), keys)
+    if not shared:
+        raise ValueError(f"The datasets have none of {list(keys)} in common")
+
+    columns = []
+    for name, df in frames.items():
+        #Categorical keys with different categories would not line up, compare them as text
+        key_values = {key: df[key].astype(str) if isinstance(df[key].dtype, pd.CategoricalDtype) else df[key]
+                      for key in shared}
+        column = df[value].groupby([key_values[key] for key in shared], dropna=False, observed=True).agg(agg)
+        columns.append(column.rename(name))
+
+    return pd.concat(columns, axis=1, join=how).reset_index()
+
+
+def join(left, right, keys=join_keys, how="inner", suffixes=("_left", "_right")):
+    '''
+    Row level join of two datasets on the keys they share
+    '''
+    shared = _keys([left, right], keys)
+    if not shared:
+        raise ValueError(f"The datasets have none of {list(keys)} in common")
+
+    def as_text(df):
+        return df.assign(**{key: df[key].astype(str) for key in shared if isinstance(df[key].dtype, pd.CategoricalDtype)})
+
+    return as_text(left).merge(as_text(right), on=shared, how=how, suffixes=suffixes)
+
+
+class Workspace:
+    '''
+    The named datasets one session has pulled, each with the query it came from. The
+    newest is active (what the EDA bot's df is), the others stay around for comparisons
+    until the session's dataset count or memory budget pushes them out
+    '''
+
+    def __init__(self, max_datasets=workspace_max_datasets, max_bytes=workspace_max_bytes):
+        self.max_datasets = max_datasets
+        self.max_bytes = max_bytes
+        self._datasets = OrderedDict()
+        self.active_name = None
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def add(self, df, query):
+        '''
+        Adds a pull and makes it active. The same query again replaces the old copy.
+        Returns its name
+        '''
+        name = dataset_name(query)
+        base, number = name, 1
+        while name in self._datasets and self._datasets[name]["query"] != query:
+            number += 1
+            name = f"{base}_{number}"
+
+        store = DatasetStore()
+        store.set(df)
+        self._datasets[name] = {"store": store, "query": dict(query), "rows": len(df),
+                                "bytes": int(df.memory_usage(index=False, deep=True).sum())}
+        self.use(name)
+        self.evict()
+
+        return name
+
+    def use(self, name):
+        '''
+        Makes a dataset active, which also counts as using it
+        '''
+        self.active_name = name
+        self._datasets.move_to_end(name)
+
+    def evict(self):
+        '''
+        Drops least recently used datasets until the workspace fits its budgets
+        '''
+        while len(self._datasets) > 1 and (len(self._datasets) > self.max_datasets or self.nbytes() > self.max_bytes):
+            oldest = next(name for name in self._datasets if name != self.active_name)
+            del self._datasets[oldest]
+
+    def nbytes(self):
+        return sum(entry["bytes"] for entry in self._datasets.values())
+
+    @property
+    def active(self):
+        '''
+        The active dataset's DatasetStore, an empty one before anything was pulled
+        '''
+        if self.active_name is None:
+            return DatasetStore()
+
+        return self._datasets[self.active_name]["store"]
+
+    def stores(self):
+        return {name: entry["store"] for name, entry in self._datasets.items()}
+
+    def fingerprint(self):
+        '''
+        Content hash of every dataset and its name, for keys of analyses that can read them all
+        '''
+        digest = hashlib.sha256(str(self.active_name).encode("utf-8"))
+        for name, store in sorted(self.stores().items()):
+            digest.update(f"{name}={store.fingerprint()}".encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def summary(self):
+        '''
+        One row per dataset for display: name, rows, memory and the query
+        '''
+        return [{"name": name, "rows": entry["rows"], "MB": round(entry["bytes"] / 1024 ** 2, 1),
+                 "active": name == self.active_name,
+                 "query": "&".join(f"{param}={value}" for param, value in entry["query"].items())}
+                for name, entry in self._datasets.items()]
+
+    def describe(self):
+        '''
+        The other datasets, told to the EDA bot so it can combine them with df
+        '''
+        others = [entry for entry in self.summary() if not entry["active"]]
+        if not others:
+            return ""
+
+        listed = "; ".join(f"datasets['{entry['name']}'] ({entry['rows']} rows from {entry['query']})" for entry in others)
+
+        return (f"Besides df (which is datasets['{self.active_name}']), these datasets from earlier questions are loaded: {listed}. "
+                f"To compare them, align({{'a': df, 'b': datasets['...']}}) gives one row per {', '.join(join_keys)} and one Value column per dataset, "
+                f"join(df, datasets['...']) joins rows on those keys. Filter each to one statistic first.")